@@ -0,0 +1,219 @@
+"""Load test of the auth and post endpoints over a real local server.
+
+Seeds a scratch database (see seed.py), starts uvicorn on it in a
+subprocess and drives each scenario with httpx at every concurrency level,
+reporting throughput and p50/p95/p99 latency:
+
+    python benchmarks/load_test.py --users 100 --posts 10000 --concurrency 1,8,32 --duration 10
+
+Server settings can be overridden with --env, e.g. --env RESPONSE_CACHE_SIZE=0
+to measure post reads without the response cache. All requests come from
+one IP, so the /token limiter is opened up unless --env sets it. The client runs in one
+process; at high concurrency check that it is not the bottleneck.
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from scratch import BACKEND_DIR, load_app
+from seed import PASSWORD, WORDS, seed, username
+
+TOKEN_USERS = 8
+# Applied before --env; the token scenario measures bcrypt throughput, not the limiter
+SERVER_ENV = [
+    "LOGIN_RATE_PER_IP=1000000", "LOGIN_BURST_PER_IP=1000000",
+    "LOGIN_RATE_PER_USERNAME=1000000", "LOGIN_BURST_PER_USERNAME=1000000",
+]
+
+
+async def token(client, rng, users, tokens):
+    return await client.post("/token", data={"username": username(rng.randrange(users)), "password": PASSWORD})
+
+
+async def refresh(client, rng, users, tokens):
+    _, refresh_token = rng.choice(tokens)
+    # /refresh reads the httpOnly cookie set by /token
+    return await client.post("/refresh", headers={"Cookie": f"refresh_token={refresh_token}"})
+
+
+async def users_me(client, rng, users, tokens):
+    access_token, _ = rng.choice(tokens)
+    return await client.get("/users/me", headers={"Authorization": f"Bearer {access_token}"})
+
+
+async def search(client, rng, users, tokens):
+    return await client.get("/posts/search/", params={"q": rng.choice(WORDS), "limit": 10})
+
+
+async def read_posts(client, rng, users, tokens):
+    return await client.get(f"/{username(rng.randrange(users))}/posts/", params={"limit": 10})
+
+
+async def create_post(client, rng, users, tokens):
+    post = {
+        "title": f"load {rng.getrandbits(64):x}",
+        "content": " ".join(rng.choices(WORDS, k=40)),
+        "media_urls": [{"file_url": "/static/bench/load.png", "media_type": "image"}],
+    }
+    return await client.post(f"/{username(rng.randrange(users))}/posts/", json=post)
+
+
+SCENARIOS = {
+    "token": ("/token", token),
+    "refresh": ("/refresh", refresh),
+    "users_me": ("/users/me", users_me),
+    "search": ("/posts/search/", search),
+    "read_posts": ("/{user_name}/posts/", read_posts),
+    "create_post": ("/{user_name}/posts/", create_post),
+}
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def run_scenario(base_url, request, concurrency, duration, users, tokens, random_seed) -> dict:
+    latencies = []
+    errors = 0
+
+    async def worker(rng, client, deadline):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await request(client, rng, users, tokens)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            errors += not ok
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(
+            worker(random.Random(random_seed + i), client, deadline) for i in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed,
+        "p50": percentile(latencies, 0.50) * 1000,
+        "p95": percentile(latencies, 0.95) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, workers: int, overrides: list) -> subprocess.Popen:
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR)
+    for override in SERVER_ENV + overrides:
+        key, _, value = override.partition("=")
+        env[key] = value
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=os.getcwd(), env=env,
+    )
+
+
+async def wait_for_server(base_url: str, server: subprocess.Popen):
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        for _ in range(300):
+            if server.poll() is not None:
+                raise RuntimeError(f"server exited with code {server.returncode}")
+            try:
+                await client.get("/metrics")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+async def login(base_url: str, users: int) -> tuple:
+    # (access, refresh) token pairs for the authenticated scenarios
+    pairs = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        for i in range(min(users, TOKEN_USERS)):
+            response = await client.post("/token", data={"username": username(i), "password": PASSWORD})
+            response.raise_for_status()
+            pairs.append((response.json()["access_token"], response.json()["refresh_token"]))
+        paths = (await client.get("/openapi.json")).json()["paths"]
+    return pairs, set(paths)
+
+
+async def run(args):
+    base_url = f"http://127.0.0.1:{args.port or free_port()}"
+    server = start_server(int(base_url.rsplit(":", 1)[1]), args.workers, args.env)
+    try:
+        await wait_for_server(base_url, server)
+        tokens, paths = await login(base_url, args.users)
+        print(f"{'scenario':12} {'conc':>5} {'requests':>9} {'errors':>7} {'req/s':>9} "
+              f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for name in args.scenarios:
+            path, request = SCENARIOS[name]
+            if path not in paths:
+                print(f"{name:12} skipped: the server has no {path} route")
+                continue
+            for concurrency in args.concurrency:
+                # Short warm-up so pools, caches and connections are in place
+                await run_scenario(base_url, request, concurrency, min(1.0, args.duration), args.users, tokens, args.seed)
+                result = await run_scenario(
+                    base_url, request, concurrency, args.duration, args.users, tokens, args.seed
+                )
+                print(f"{name:12} {concurrency:>5} {result['requests']:>9} {result['errors']:>7} "
+                      f"{result['throughput']:>9.1f} {result['p50']:>8.1f} {result['p95']:>8.1f} {result['p99']:>8.1f}")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--media", type=int, default=3, help="media rows per post")
+    parser.add_argument("--dir", help="scratch directory; reused as-is if it already has data")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per scenario and concurrency level")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--port", type=int, default=0, help="default: any free port")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="server setting override")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the generated data and requests")
+    args = parser.parse_args()
+    args.concurrency = [int(level) for level in args.concurrency.split(",")]
+    args.scenarios = args.scenarios.split(",")
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.users < 1:
+        parser.error("--users must be at least 1")
+
+    fresh = not (args.dir and os.path.exists(os.path.join(args.dir, "test.db")))
+    app_module = load_app(args.dir)
+    if fresh:
+        counts = seed(app_module, args.users, args.posts, args.media, args.seed)
+        print(f"Seeded {counts['users']} users, {counts['posts']} posts, {counts['media']} media in {os.getcwd()}")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
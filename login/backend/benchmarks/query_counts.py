@@ -0,0 +1,68 @@
+"""SQL statements issued per request by the post endpoints.
+
+Seeds a scratch database, calls each endpoint at several page sizes and
+counts statements with a SQLAlchemy before_cursor_execute listener. Exits
+non-zero if any endpoint's count grows with the page size (an N+1):
+
+    python benchmarks/query_counts.py
+"""
+import sys
+
+from scratch import load_app
+PAGE_SIZES = [1, 10, 50]
+
+
+def main():
+    app_module = load_app()
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    statements = []
+
+    def record(*args):
+        statements.append(args[2])
+
+    def count(client, method, url, **kwargs):
+        # Measure the queries behind a response, not the response cache
+        app_module.post_responses.invalidate()
+        statements.clear()
+        response = client.request(method, url, **kwargs)
+        assert response.status_code == 200, response.text
+        return len(statements)
+
+    with TestClient(app_module.app) as client:
+        # Engines are created at startup; count the writer, reader and async one
+        event.listen(app_module.engine, "before_cursor_execute", record)
+        event.listen(app_module.read_engine, "before_cursor_execute", record)
+        event.listen(app_module.async_engine.sync_engine, "before_cursor_execute", record)
+        client.post("/users/", json={"username": "bench", "email": "bench@example.com", "name": "Bench", "password": "bench"})
+        token = client.post("/token", data={"username": "bench", "password": "bench"}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        media = [{"file_url": "/static/a.png", "media_type": "image"}, {"file_url": "/static/b.mp4", "media_type": "video"}]
+        for i in range(max(PAGE_SIZES)):
+            client.post("/bench/posts/", json={"title": f"post {i}", "content": "searchable text", "media_urls": media})
+
+        failed = False
+        endpoints = {
+            "GET /{user_name}/posts/": lambda n: count(client, "GET", f"/bench/posts/?limit={n}"),
+            "GET /posts/search/": lambda n: count(client, "GET", f"/posts/search/?q=searchable&limit={n}"),
+            "GET /feed/": lambda n: count(client, "GET", f"/feed/?limit={n}"),
+            "GET /posts/batch/": lambda n: count(client, "GET", "/posts/batch/", params={"ids": list(range(1, n + 1))}),
+            "GET /users/batch/": lambda n: count(client, "GET", "/users/batch/", params={"ids": list(range(1, n + 1))}),
+            "GET /posts/{post_id}": lambda n: count(client, "GET", "/posts/1"),
+            "GET /{user_name}/posts/{title}": lambda n: count(client, "GET", "/bench/posts/post 0"),
+            "POST /{user_name}/posts/": lambda n: count(client, "POST", "/bench/posts/", json={"title": "new", "content": "x", "media_urls": media * n}),
+            "PUT /posts/{post_id}": lambda n: count(client, "PUT", "/posts/1", json={"title": "post 0"}, headers=headers),
+        }
+        for name, call in endpoints.items():
+            call(1)  # warm the user/token caches
+            counts = [call(n) for n in PAGE_SIZES]
+            status = "ok" if len(set(counts)) == 1 else "GROWS WITH PAGE SIZE"
+            failed = failed or status != "ok"
+            print(f"{name:34} {counts}  {status}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""Shared setup for the benchmark scripts: a migrated scratch database."""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(directory=None):
+    """chdir into a scratch directory, migrate its test.db and import main.
+
+    main.py and migrate.py use ./test.db and ./static, so everything runs
+    relative to the scratch directory. DATABASE_URL is pinned to that file
+    so an exported setting never points a benchmark at a real database.
+    """
+    directory = directory or tempfile.mkdtemp(prefix="chrypy-bench-")
+    os.makedirs(directory, exist_ok=True)
+    os.chdir(directory)
+    os.makedirs("static", exist_ok=True)
+    os.environ["DATABASE_URL"] = "sqlite:///./test.db"
+    os.environ.pop("DATABASE_READ_URL", None)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    import migrate
+    with contextlib.redirect_stdout(io.StringIO()):
+        migrate.run_migrations()
+    import main
+    return main
@@ -0,0 +1,95 @@
+"""Seed a scratch database with N users and M posts with media.
+
+Users are named user0..user{N-1}, all with the password "bench"; posts are
+spread round-robin over them with content drawn from a small vocabulary so
+search has something to rank. Rows go in with bulk Core inserts (the FTS
+triggers still fire), so large datasets take seconds:
+
+    python benchmarks/seed.py --users 100 --posts 10000 --media 3 --dir /tmp/chrypy-bench
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from scratch import load_app
+
+PASSWORD = "bench"
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+    "incididunt ut labore et dolore magna aliqua travel recipe garden music photo "
+    "python sqlite search cache index queue worker stream upload image video"
+).split()
+BATCH_SIZE = 1000
+
+
+def username(i: int) -> str:
+    return f"user{i}"
+
+
+def seed(app_module, users: int, posts: int, media: int, random_seed: int = 0) -> dict:
+    """Insert the rows through a short-lived engine; returns row counts."""
+    from sqlalchemy import create_engine, insert
+
+    rng = random.Random(random_seed)
+    engine = create_engine(app_module.DATABASE_URL)
+    # One bcrypt hash for everyone: hashing N passwords would dominate seeding
+    hashed_password = app_module.get_password_hash(PASSWORD)
+    start = datetime.utcnow() - timedelta(days=365)
+    try:
+        with engine.begin() as conn:
+            user_ids = conn.execute(
+                insert(app_module.User).returning(app_module.User.id, sort_by_parameter_order=True),
+                [
+                    {"name": f"User {i}", "username": username(i), "email": f"{username(i)}@example.com",
+                     "hashed_password": hashed_password, "is_active": True}
+                    for i in range(users)
+                ],
+            ).scalars().all()
+        for offset in range(0, posts, BATCH_SIZE):
+            count = min(BATCH_SIZE, posts - offset)
+            post_rows = []
+            for i in range(offset, offset + count):
+                post_rows.append({
+                    "title": f"post {i} " + " ".join(rng.sample(WORDS, 3)),
+                    "content": " ".join(rng.choices(WORDS, k=40)),
+                    "cover_image_url": f"/static/bench/{i}-0.png",
+                    "createtime": start + timedelta(seconds=i * 31536000 // max(posts, 1)),
+                    "user_id": user_ids[i % users],
+                })
+            with engine.begin() as conn:
+                post_ids = conn.execute(
+                    insert(app_module.Post).returning(app_module.Post.id, sort_by_parameter_order=True), post_rows
+                ).scalars().all()
+                media_rows = [
+                    {"post_id": post_id, "file_url": f"/static/bench/{offset + n}-{j}.png", "media_type": "image"}
+                    for n, post_id in enumerate(post_ids)
+                    for j in range(media)
+                ]
+                if media_rows:
+                    conn.execute(insert(app_module.Media), media_rows)
+    finally:
+        engine.dispose()
+    return {"users": users, "posts": posts, "media": posts * media}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--media", type=int, default=3, help="media rows per post")
+    parser.add_argument("--dir", help="scratch directory (default: a new temporary one)")
+    args = parser.parse_args()
+    if args.users < 1:
+        parser.error("--users must be at least 1")
+
+    app_module = load_app(args.dir)
+    started = time.perf_counter()
+    counts = seed(app_module, args.users, args.posts, args.media)
+    print(f"Seeded {counts['users']} users, {counts['posts']} posts, {counts['media']} media "
+          f"in {time.perf_counter() - started:.1f}s into {os.getcwd()}")
+
+
+if __name__ == "__main__":
+    main()
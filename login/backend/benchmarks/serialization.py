@@ -0,0 +1,91 @@
+"""Time to serialize one page of 100 posts, each with media.
+
+Compares FastAPI's response_model path (validate every ORM row through
+List[PostResponse], then the json module) with the post_dict path the list
+endpoints use, encoded by render_json with and without orjson:
+
+    python benchmarks/serialization.py [--media 3] [--repeat 200]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime
+
+from scratch import load_app
+PAGE_SIZE = 100
+
+
+def make_posts(app_module, media_per_post: int) -> list:
+    # Transient ORM objects: serialization cost only, no database reads
+    posts = []
+    for i in range(PAGE_SIZE):
+        post = app_module.Post(
+            id=i + 1, title=f"post {i}", content="some content " * 20, user_id=1,
+            cover_image_url=f"/static/media/ab/{i:064x}.png", createtime=datetime(2024, 1, 1, 12, 0, i % 60),
+            cover_thumbnail_url=f"/static/media/ab/{i:064x}.thumb.webp", cover_medium_url=None,
+        )
+        post.media = [
+            app_module.Media(
+                id=i * media_per_post + j + 1, post_id=i + 1, media_type="image",
+                file_url=f"/static/media/ab/{i:064x}.png", thumbnail_url=None, medium_url=None,
+            )
+            for j in range(media_per_post)
+        ]
+        posts.append(post)
+    return posts
+
+
+def timed(call, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+async def response_model_path(app_module, posts: list, repeat: int) -> float:
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+
+    route = next(route for route in app_module.app.routes if getattr(route, "name", None) == "read_posts")
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        content = await serialize_response(field=route.response_field, response_content=posts)
+        JSONResponse(content).body
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--media", type=int, default=3, help="media rows per post")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    app_module = load_app()
+    posts = make_posts(app_module, args.media)
+
+    def fast_path():
+        return app_module.render_json([app_module.post_dict(post) for post in posts])
+
+    results = {"response_model + json": asyncio.run(response_model_path(app_module, posts, args.repeat))}
+    orjson = app_module.orjson
+    app_module.orjson = None
+    results["post_dict + json"] = timed(fast_path, args.repeat)
+    app_module.orjson = orjson
+    if orjson is not None:
+        results["post_dict + orjson"] = timed(fast_path, args.repeat)
+    else:
+        print("orjson is not installed; skipping post_dict + orjson")
+
+    baseline = results["response_model + json"]
+    print(f"{PAGE_SIZE} posts x {args.media} media, median of {args.repeat} runs")
+    for name, ms in results.items():
+        print(f"{name:24} {ms:8.2f} ms  {baseline / ms:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Worker boot time: importing main and running its lifespan startup.
+
+Each run is a fresh interpreter, like a new Uvicorn/Gunicorn worker or a
+--reload restart, against an already migrated scratch database:
+
+    python benchmarks/startup.py --runs 10
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from scratch import BACKEND_DIR, load_app
+
+WORKER = """
+import asyncio, json, sys, time
+sys.path.insert(0, {backend_dir!r})
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def boot():
+    async with main.app.router.lifespan_context(main.app):
+        ready = time.perf_counter()
+    return ready
+
+ready = asyncio.run(boot())
+print(json.dumps({{"import": imported - start, "startup": ready - imported}}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="chrypy-bench-")
+    load_app(directory)
+    code = WORKER.format(backend_dir=BACKEND_DIR)
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, "-W", "ignore", "-c", code],
+            cwd=directory, capture_output=True, text=True, check=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    for phase in ("import", "startup"):
+        timings = [result[phase] * 1000 for result in results]
+        print(f"{phase:8} median {statistics.median(timings):7.1f} ms   min {min(timings):7.1f} ms   max {max(timings):7.1f} ms")
+    totals = [(result["import"] + result["startup"]) * 1000 for result in results]
+    print(f"{'total':8} median {statistics.median(totals):7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Requests per second on /users/me, with and without the revocation cache.
+
+The comparison run syncs the cache from token_blacklist on every request,
+i.e. one blacklist query per request like before the cache existed, so
+the two numbers can be compared on the same machine:
+
+    python benchmarks/users_me.py --requests 2000
+"""
+import argparse
+import time
+
+from scratch import load_app
+
+
+def run(client, headers, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.get("/users/me", headers=headers)
+        assert response.status_code == 200, response.text
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--revoked", type=int, default=1000, help="rows to seed in token_blacklist")
+    args = parser.parse_args()
+
+    app_module = load_app()
+    from datetime import datetime, timedelta
+    from fastapi.testclient import TestClient
+
+    with TestClient(app_module.app) as client:
+        db = app_module.SessionLocal()
+        expires_at = datetime.now() + timedelta(days=1)
+        db.add_all(app_module.TokenBlacklist(jti=f"seed-{i}", expires_at=expires_at) for i in range(args.revoked))
+        db.commit()
+        db.close()
+
+        client.post("/users/", json={"username": "bench", "email": "bench@example.com", "name": "Bench", "password": "bench"})
+        token = client.post("/token", data={"username": "bench", "password": "bench"}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        run(client, headers, 50)  # warm up
+
+        cached = run(client, headers, args.requests)
+
+        sync_seconds = app_module.settings.TOKEN_BLACKLIST_SYNC_SECONDS
+        app_module.settings.TOKEN_BLACKLIST_SYNC_SECONDS = -1
+        try:
+            per_request_query = run(client, headers, args.requests)
+        finally:
+            app_module.settings.TOKEN_BLACKLIST_SYNC_SECONDS = sync_seconds
+
+    print(f"/users/me  db lookup per request: {per_request_query:8.1f} req/s")
+    print(f"/users/me  revocation cache:      {cached:8.1f} req/s")
+
+
+if __name__ == "__main__":
+    main()
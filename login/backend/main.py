@@ -1,36 +1,201 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextvars import ContextVar
 from typing import Optional, List, Dict, Any
+import asyncio
+import base64
+import bisect
+import gzip
+import hashlib
+import heapq
+import json
+import math
+import mimetypes
+import multiprocessing
 import secrets
+import threading
+import time
 
-from fastapi import FastAPI, Depends, HTTPException, status, Request, Response
+from fastapi import FastAPI, Depends, HTTPException, Query, status, Request, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel
 from pydantic_settings import BaseSettings
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import create_engine, and_, delete, event, func, insert, or_, select, tuple_, update, Column, Index, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.sql.sqltypes import TIMESTAMP
 from datetime import datetime
 from sqlalchemy.sql.expression import text
 from fastapi.middleware.cors import CORSMiddleware
-import shutil
+import tempfile
 from fastapi.staticfiles import StaticFiles
-from fastapi import UploadFile, File
-from sqlalchemy.orm import Session, sessionmaker, relationship
-
-app = FastAPI()
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse
+import multipart
+from multipart.multipart import parse_options_header
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it no image variants are made
+    Image = None
+try:
+    import orjson
+except ImportError:  # orjson is optional; render_json falls back to the json module
+    orjson = None
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only gzip variants are made
+    brotli = None
+from sqlalchemy.orm import Session, sessionmaker, relationship, selectinload
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Per-worker setup. Schema creation lives in migrate.py, not here.
+    init_database()
+    clean_upload_tmp_dir()
+    load_token_blacklist()
+    await asyncio.to_thread(title_index.rebuild, load_post_titles)
+    background_tasks.append(asyncio.create_task(token_blacklist_sweeper()))
+    background_tasks.append(asyncio.create_task(title_index_refresher()))
+    background_tasks.append(asyncio.create_task(account_deletion_worker()))
+    yield
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    shutdown_image_executor()
+    await dispose_database()
+
+app = FastAPI(lifespan=lifespan)
+
+# Text-like assets worth storing precompressed; images and video already are
+PRECOMPRESS_EXTENSIONS = {".css", ".csv", ".html", ".js", ".json", ".map", ".md", ".svg", ".txt", ".wasm", ".xml"}
+# Suffix of each precompressed variant, in order of preference
+PRECOMPRESSED_ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+RANGE_CHUNK_BYTES = 64 * 1024
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    encodings = set()
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q=") and params[2:] in ("0", "0.0", "0.00", "0.000"):
+            continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+def parse_byte_range(header: str, size: int) -> Optional[tuple]:
+    """(start, end) of a single "bytes=" range; None to send the whole file.
+
+    Raises ValueError when the range cannot be satisfied.
+    """
+    unit, _, spec = header.partition("=")
+    first, _, last = spec.strip().partition("-")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None  # multiple ranges may be answered with the whole file
+    if not (first or last) or any(part and not part.isdigit() for part in (first, last)):
+        return None  # malformed ranges are ignored
+    if not first:  # suffix range: the last N bytes
+        if int(last) == 0 or size == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - int(last)), size - 1
+    if last and int(last) < int(first):
+        return None
+    if int(first) >= size:
+        raise ValueError("range starts past the end of the file")
+    return int(first), min(int(last), size - 1) if last else size - 1
+
+
+def read_file_range(path: str, start: int, end: int):
+    with open(path, "rb") as file:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = file.read(min(RANGE_CHUNK_BYTES, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+class MediaStaticFiles(StaticFiles):
+    """StaticFiles with caching headers, precompressed variants and byte ranges.
+
+    Uploads under media/ are named by their content hash (see UploadStream),
+    so they are served as immutable. Everything else must be revalidated.
+    Compressible files are served from a sibling .br/.gz file when the client
+    accepts it, and Range requests (video seeking) get a 206 with just the
+    requested bytes.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        full_path = str(full_path)
+        request_headers = Headers(scope=scope)
+        relative_path = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+        headers = {
+            "Cache-Control": "public, max-age=31536000, immutable"
+            if relative_path.startswith("media/") else "no-cache",
+        }
+        media_type = mimetypes.guess_type(full_path)[0] or "text/plain"
+        compressible = os.path.splitext(full_path)[1].lower() in PRECOMPRESS_EXTENSIONS
+        if compressible:
+            headers["Vary"] = "Accept-Encoding"
+        byte_range = request_headers.get("range") if scope["method"] == "GET" else None
+
+        # Ranges always refer to the identity encoding
+        if compressible and byte_range is None:
+            accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+            for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+                if encoding in accepted and os.path.isfile(full_path + suffix):
+                    headers["Content-Encoding"] = encoding
+                    full_path = full_path + suffix
+                    stat_result = os.stat(full_path)
+                    break
+
+        response = FileResponse(
+            full_path, status_code=status_code, stat_result=stat_result, media_type=media_type, headers=headers
+        )
+        if "Content-Encoding" not in headers:
+            response.headers["Accept-Ranges"] = "bytes"
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        if byte_range is None or status_code != 200:
+            return response
+
+        # A Range with a stale If-Range validator gets the whole new file
+        if_range = request_headers.get("if-range")
+        if if_range is not None and if_range not in (response.headers["etag"], response.headers["last-modified"]):
+            return response
+        size = stat_result.st_size
+        try:
+            span = parse_byte_range(byte_range, size)
+        except ValueError:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}", **headers})
+        if span is None:
+            return response
+        start, end = span
+        range_headers = {
+            key: response.headers[key] for key in ("etag", "last-modified", "cache-control", "accept-ranges")
+        }
+        range_headers.update({"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(end - start + 1)})
+        return StreamingResponse(
+            read_file_range(full_path, start, end), status_code=206, headers=range_headers, media_type=media_type
+        )
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
-# Database configuration
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+app.mount("/static", MediaStaticFiles(directory="static"), name="static")
 
 Base = declarative_base()
 import os
@@ -39,16 +204,82 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
-# Create database tables
-def create_tables():
-    Base.metadata.create_all(bind=engine)
-
 # Settings class for environment variables
 class Settings(BaseSettings):
     SECRET_KEY: str = "your_default_secret_key"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 15
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
+    DATABASE_URL: str = "sqlite:///./test.db"
+    # Where GET requests read from; unset means DATABASE_URL, opened read-only
+    DATABASE_READ_URL: Optional[str] = None
+    # Connection pools (read and async engines) and SQLite pragmas applied on connect
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    # SQLite runs one write at a time, so the writer pool stays small
+    DB_WRITE_POOL_SIZE: int = 2
+    DB_WRITE_MAX_OVERFLOW: int = 2
+    DB_POOL_TIMEOUT_SECONDS: int = 30
+    DB_BUSY_TIMEOUT_MS: int = 5000
+    DB_MMAP_SIZE: int = 268435456
+    # bcrypt runs on its own bounded pool instead of the event loop
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_QUEUE_LIMIT: int = 32
+    # Token buckets checked by /token before any bcrypt work: a burst of
+    # attempts, then RATE attempts per second, per client IP and per username
+    LOGIN_RATE_PER_IP: float = 1.0
+    LOGIN_BURST_PER_IP: int = 20
+    LOGIN_RATE_PER_USERNAME: float = 0.2
+    LOGIN_BURST_PER_USERNAME: int = 5
+    LOGIN_LIMITER_MAX_KEYS: int = 10000
+    # How often each worker picks up logouts recorded by other workers
+    TOKEN_BLACKLIST_SYNC_SECONDS: int = 5
+    # Expired blacklist rows are deleted in batches by a background task
+    TOKEN_BLACKLIST_SWEEP_SECONDS: int = 300
+    TOKEN_BLACKLIST_SWEEP_BATCH: int = 1000
+    # Authenticated-user and verified-token caches used by get_current_user
+    USER_CACHE_SIZE: int = 1024
+    USER_CACHE_TTL_SECONDS: int = 30
+    TOKEN_CACHE_SIZE: int = 4096
+    # Rendered post GET responses; other workers' writes show up within the TTL
+    RESPONSE_CACHE_SIZE: int = 2048
+    RESPONSE_CACHE_TTL_SECONDS: int = 30
+    # Uploads are streamed to disk and rejected once they pass this size
+    UPLOAD_MAX_BYTES: int = 50 * 1024 * 1024
+    UPLOAD_WRITE_BUFFER_BYTES: int = 1024 * 1024
+    # Temp files of uploads idle this long are deleted at startup
+    UPLOAD_TMP_MAX_AGE_SECONDS: int = 3600
+    # Posts written per transaction by the NDJSON bulk import
+    IMPORT_BATCH_SIZE: int = 500
+    # Longer import lines are skipped (and reported) without being buffered
+    IMPORT_MAX_LINE_BYTES: int = 1024 * 1024
+    # Rows fetched per round trip by the NDJSON export
+    EXPORT_BATCH_SIZE: int = 500
+    # Thumbnail/medium variants of uploaded images, built on a process pool
+    IMAGE_WORKERS: int = 2
+    IMAGE_QUEUE_LIMIT: int = 16
+    IMAGE_THUMBNAIL_WIDTH: int = 320
+    IMAGE_MEDIUM_WIDTH: int = 1024
+    IMAGE_VARIANT_FORMAT: str = "webp"
+    # In-memory title index for autocomplete: capacity, longest indexed
+    # prefix, how often it reads posts created by other workers, and how
+    # often it is rebuilt to drop their deletions and renames
+    TITLE_INDEX_MAX_TITLES: int = 200000
+    TITLE_INDEX_MAX_LENGTH: int = 100
+    TITLE_INDEX_REFRESH_SECONDS: int = 60
+    TITLE_INDEX_REBUILD_SECONDS: int = 3600
+    # Most ids accepted by one /users/batch/ or /posts/batch/ request
+    BATCH_MAX_IDS: int = 100
+    # Account deletion runs in the background: posts (with their media)
+    # removed per transaction, pause between transactions so other writers
+    # get the lock, how often idle workers look for queued jobs, and how long
+    # a job may go without progress before another worker takes it over
+    ACCOUNT_DELETION_BATCH_SIZE: int = 200
+    ACCOUNT_DELETION_PAUSE_MS: int = 50
+    ACCOUNT_DELETION_POLL_SECONDS: int = 30
+    ACCOUNT_DELETION_LEASE_SECONDS: int = 120
+    # Log statements slower than this many milliseconds; 0 turns the log off
+    SLOW_QUERY_MS: int = 0
 
     model_config = {
         "env_file": ".env",
@@ -56,11 +287,6 @@ class Settings(BaseSettings):
     }
 settings = Settings()
 
-# Create database tables
-create_tables()
-
-
-
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -68,30 +294,189 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
-DATABASE_URL = "sqlite:///./test.db"
+# Database configuration
+DATABASE_URL = settings.DATABASE_URL
+# Latest migration in migrate.py, which creates and upgrades the schema
+SCHEMA_VERSION = 10
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers proceed while a writer commits instead of queueing behind it
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={settings.DB_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={settings.DB_MMAP_SIZE}")
+    cursor.close()
+
+
+def set_sqlite_read_pragmas(dbapi_connection, connection_record):
+    # journal_mode is left to the writer: changing it needs write access
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.execute(f"PRAGMA busy_timeout={settings.DB_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={settings.DB_MMAP_SIZE}")
+    cursor.close()
+
+
+def read_only_url(url: str) -> str:
+    # SQLite URI filename, so the file is opened with mode=ro
+    url = make_url(url)
+    if url.get_backend_name() != "sqlite" or not url.database or url.database == ":memory:":
+        return url.render_as_string(hide_password=False)
+    return url.set(database=f"file:{url.database}", query={"mode": "ro", "uri": "true"}).render_as_string(
+        hide_password=False
+    )
+
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+class SessionRouter:
+    """Chooses the session factory for a request.
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    GET and HEAD requests read from the reader; everything else goes to the
+    writer. A primary/replica setup only needs DATABASE_READ_URL, or a
+    subclass assigned to session_router for other routing rules.
+    """
 
-Base = declarative_base()
-Base.metadata.create_all(engine)
-# Token blacklist for storing invalidated tokens
-token_blacklist = set()
+    READ_METHODS = ("GET", "HEAD")
+
+    def __init__(self, writer: sessionmaker, reader: sessionmaker):
+        self.writer = writer
+        self.reader = reader
+
+    def for_request(self, request: Request) -> sessionmaker:
+        return self.reader if request.method in self.READ_METHODS else self.writer
+
+
+# Created once per worker by init_database() in the lifespan handler.
+# engine/SessionLocal is the writer, also used by background jobs.
+engine = None
+SessionLocal = None
+read_engine = None
+ReadSessionLocal = None
+session_router: Optional[SessionRouter] = None
+async_engine = None
+AsyncSessionLocal = None
+
+# False when posts_fts is missing (e.g. SQLite built without FTS5); search
+# then falls back to LIKE
+search_index_enabled = True
+
+def init_database():
+    global engine, SessionLocal, read_engine, ReadSessionLocal, session_router
+    global async_engine, AsyncSessionLocal, search_index_enabled
+    pool_options = {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT_SECONDS,
+    }
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        pool_size=settings.DB_WRITE_POOL_SIZE,
+        max_overflow=settings.DB_WRITE_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+    )
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    read_engine = create_engine(
+        read_only_url(settings.DATABASE_READ_URL or DATABASE_URL),
+        connect_args={"check_same_thread": False},
+        **pool_options,
+    )
+    ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+    session_router = SessionRouter(SessionLocal, ReadSessionLocal)
+
+    # Async engine for the async def endpoints (login, logout, get_current_user),
+    # so their queries don't block the event loop
+    async_engine = create_async_engine(
+        DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1),
+        poolclass=AsyncAdaptedQueuePool,  # aiosqlite defaults to NullPool
+        **pool_options,
+    )
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    for sync_engine in (engine, read_engine, async_engine.sync_engine):
+        event.listen(sync_engine, "before_cursor_execute", start_statement_timer)
+        event.listen(sync_engine, "after_cursor_execute", record_statement)
+
+    if read_engine.dialect.name == "sqlite":
+        event.listen(read_engine, "connect", set_sqlite_read_pragmas)
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", set_sqlite_pragmas)
+        event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+        with engine.connect() as conn:
+            version = conn.execute(text("PRAGMA user_version")).scalar()
+            search_index_enabled = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = 'posts_fts'")
+            ).first() is not None
+        if version < SCHEMA_VERSION:
+            raise RuntimeError(
+                f"Database schema is at version {version}, expected {SCHEMA_VERSION}. Run: python migrate.py"
+            )
+
+
+async def dispose_database():
+    await async_engine.dispose()
+    read_engine.dispose()
+    engine.dispose()
+
+# Token blacklist for storing invalidated tokens: jti -> exp (unix time).
+# Mirrors the token_blacklist table so the per-request revocation check
+# needs no query; token_blacklist_expiry orders entries for eviction.
+token_blacklist: Dict[str, float] = {}
+token_blacklist_expiry: List[tuple] = []
+token_blacklist_last_id = 0
+token_blacklist_synced_at = 0.0
 
 # Token model for blacklist
 class TokenBlacklist(Base):
     __tablename__ = "token_blacklist"
     id = Column(Integer, primary_key=True, index=True)
     jti = Column(String, unique=True, index=True)
-    expires_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # sync_token_blacklist reads id > last seen id; AUTOINCREMENT (migration 9)
+    # keeps the sweeper's deletions from freeing ids for reuse
+    __table_args__ = {"sqlite_autoincrement": True}
+
+
+def evict_expired_tokens(now: float):
+    while token_blacklist_expiry and token_blacklist_expiry[0][0] <= now:
+        _, jti = heapq.heappop(token_blacklist_expiry)
+        token_blacklist.pop(jti, None)
 
-    @classmethod
-    def is_blacklisted(cls, jti: str, db: Session) -> bool:
-        return db.query(cls).filter(cls.jti == jti).first() is not None
+
+def add_revoked_token(jti: str, expires_at: datetime):
+    exp = expires_at.timestamp()
+    if exp <= time.time() or jti in token_blacklist:
+        return
+    token_blacklist[jti] = exp
+    heapq.heappush(token_blacklist_expiry, (exp, jti))
+
+
+def sync_token_blacklist(db: Session):
+    # Only rows added since the last sync (by this or another worker)
+    global token_blacklist_last_id, token_blacklist_synced_at
+    rows = (
+        db.query(TokenBlacklist.id, TokenBlacklist.jti, TokenBlacklist.expires_at)
+        .filter(TokenBlacklist.id > token_blacklist_last_id)
+        .order_by(TokenBlacklist.id)
+        .all()
+    )
+    for row_id, jti, expires_at in rows:
+        add_revoked_token(jti, expires_at)
+        token_blacklist_last_id = row_id
+    token_blacklist_synced_at = time.monotonic()
+
+
+def token_blacklist_stale() -> bool:
+    return time.monotonic() - token_blacklist_synced_at > settings.TOKEN_BLACKLIST_SYNC_SECONDS
+
+
+def is_token_revoked(jti: str) -> bool:
+    evict_expired_tokens(time.time())
+    return jti in token_blacklist
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -109,24 +494,68 @@ class User(Base):
 class Post(Base):
     __tablename__ = "posts"
     id = Column(Integer, primary_key=True, index=True)
-    title = Column(String, index=True, nullable=False)
-    content = Column(String, index=True)
+    title = Column(String, nullable=False)
+    content = Column(String)
     cover_image_url = Column(String, nullable=False)
+    cover_thumbnail_url = Column(String, nullable=True)
+    cover_medium_url = Column(String, nullable=True)
     # This version lets your Python app set the time
     createtime = Column(TIMESTAMP(timezone=True), nullable=False, default=datetime.utcnow)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
-    media = relationship("Media", back_populates="post") # ADD THIS LINE
+    media = relationship("Media", back_populates="post", cascade="all, delete-orphan") # ADD THIS LINE
+    # Keyset pagination of a user's posts, and read_post's lookup by title.
+    __table_args__ = (
+        Index("ix_posts_user_id_createtime_id", "user_id", "createtime", "id"),
+        Index("ix_posts_user_id_title", "user_id", "title"),
+        # TitleIndex syncs on id > last seen id; AUTOINCREMENT (migration 10)
+        # keeps a deleted newest post's id from being handed out again
+        {"sqlite_autoincrement": True},
+    )
 class Media(Base):
     __tablename__ = "media"
     id = Column(Integer, primary_key=True, index=True)
-    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), nullable=False)
-    file_url = Column(String, nullable=False)
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), nullable=False, index=True)
+    file_url = Column(String, nullable=False, index=True)
     media_type = Column(String, nullable=False)
     media_type = Column(String, nullable=False)
+    thumbnail_url = Column(String, nullable=True)
+    medium_url = Column(String, nullable=True)
     post = relationship("Post", back_populates="media") # ADD THIS LINE
-Base.metadata.create_all(bind=engine)
 
+# Home feed: one row per post with what the feed shows, newest first. Kept
+# in sync with posts and users by triggers (see migrate.py), so every write
+# path - create_post, the import, update_post, delete_post - maintains it.
+class TimelineEntry(Base):
+    __tablename__ = "timeline"
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    username = Column(String, nullable=False)
+    title = Column(String, nullable=False)
+    cover_image_url = Column(String, nullable=False)
+    cover_thumbnail_url = Column(String, nullable=True)
+    createtime = Column(TIMESTAMP(timezone=True), nullable=False)
+    __table_args__ = (
+        Index("ix_timeline_createtime_post_id", "createtime", "post_id"),
+    )
+
+# Background account deletions (see delete_user). Kept after the user row is
+# gone so its status stays readable; user_id is not a foreign key for that reason.
+class AccountDeletion(Base):
+    __tablename__ = "account_deletions"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    username = Column(String, nullable=False)
+    # pending -> running -> done, or failed (a new DELETE queues it again)
+    status = Column(String, nullable=False, index=True)
+    posts_total = Column(Integer, nullable=False, default=0)
+    posts_deleted = Column(Integer, nullable=False, default=0)
+    media_deleted = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # Bumped on every chunk; a running job that stops updating is taken over
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
 
 def get_db():
     db = SessionLocal()
@@ -136,6 +565,249 @@ def get_db():
         db.close()
 
 
+def get_routed_db(request: Request):
+    # Read-only session for GET/HEAD, writer session otherwise (see SessionRouter)
+    db = session_router.for_request(request)()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def load_token_blacklist():
+    db = SessionLocal()
+    try:
+        sync_token_blacklist(db)
+    finally:
+        db.close()
+
+
+token_blacklist_metrics = {
+    "rows_pruned_total": 0,
+    "table_rows": 0,
+    "last_sweep_timestamp": 0.0,
+}
+
+
+def sweep_expired_tokens() -> int:
+    # Small transactions so a large backlog never holds the write lock for long.
+    # Rows are stored with local-time expires_at (see /logout).
+    pruned = 0
+    while True:
+        db = SessionLocal()
+        try:
+            expired_ids = (
+                select(TokenBlacklist.id)
+                .where(TokenBlacklist.expires_at < datetime.now())
+                .limit(settings.TOKEN_BLACKLIST_SWEEP_BATCH)
+            )
+            deleted = db.execute(delete(TokenBlacklist).where(TokenBlacklist.id.in_(expired_ids))).rowcount
+            db.commit()
+            if deleted < settings.TOKEN_BLACKLIST_SWEEP_BATCH:
+                token_blacklist_metrics["table_rows"] = db.query(func.count(TokenBlacklist.id)).scalar()
+        finally:
+            db.close()
+        pruned += deleted
+        if deleted < settings.TOKEN_BLACKLIST_SWEEP_BATCH:
+            break
+    token_blacklist_metrics["rows_pruned_total"] += pruned
+    token_blacklist_metrics["last_sweep_timestamp"] = time.time()
+    return pruned
+
+
+async def token_blacklist_sweeper():
+    while True:
+        try:
+            await asyncio.to_thread(sweep_expired_tokens)
+        except Exception as e:
+            print(f"Token blacklist sweep failed: {e}")
+        await asyncio.sleep(settings.TOKEN_BLACKLIST_SWEEP_SECONDS)
+
+
+background_tasks: List[asyncio.Task] = []
+
+
+class Histogram:
+    """Prometheus histogram with one series per tuple of label values."""
+
+    def __init__(self, name: str, description: str, labels: tuple, buckets: tuple):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [count per bucket (last one is +Inf), sum]
+        self.series: Dict[tuple, list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_values: tuple, value: float):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = [(label_values, list(counts), total) for label_values, (counts, total) in self.series.items()]
+        for label_values, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = format_labels(self.labels + ("le",), label_values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+request_latency = Histogram(
+    "http_request_duration_seconds", "Time to handle a request, by route.",
+    ("method", "route"), LATENCY_BUCKETS,
+)
+request_db_statements = Histogram(
+    "http_request_db_statements", "SQL statements executed per request, by route.",
+    ("method", "route"), (0, 1, 2, 3, 5, 10, 25, 50, 100),
+)
+request_db_time = Histogram(
+    "http_request_db_seconds", "Time spent executing SQL per request, by route.",
+    ("method", "route"), LATENCY_BUCKETS,
+)
+# Sections of a request worth timing on their own: bcrypt and the auth dependency
+operation_time = Histogram(
+    "app_operation_duration_seconds", "Time spent in instrumented operations.",
+    ("operation",), LATENCY_BUCKETS,
+)
+requests_total: Dict[tuple, int] = {}
+requests_in_flight = 0
+
+# [statements, seconds] for the request being handled; None outside requests
+request_db_stats: ContextVar[Optional[list]] = ContextVar("request_db_stats", default=None)
+
+
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.statement_started_at = time.perf_counter()
+
+
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    started_at = getattr(context, "statement_started_at", None)
+    if started_at is None:
+        return
+    elapsed = time.perf_counter() - started_at
+    stats = request_db_stats.get()
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += elapsed
+    if settings.SLOW_QUERY_MS > 0 and elapsed * 1000 >= settings.SLOW_QUERY_MS:
+        print(f"Slow query ({elapsed * 1000:.1f} ms): {' '.join(statement.split())[:1000]}")
+
+
+def route_label(scope: dict) -> str:
+    # The route template rather than the raw path, so the number of series stays bounded
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if "endpoint" in scope:  # a mounted app such as /static
+        return scope.get("root_path", "") + "/{path}"
+    return "unmatched"
+
+
+class InstrumentationMiddleware:
+    """Per-route latency, status and SQL statistics for every HTTP request.
+
+    Plain ASGI rather than @app.middleware("http"), which runs each request
+    in an extra task. The timing covers the whole response, including the
+    body of streaming responses such as the NDJSON export.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        global requests_in_flight
+        stats = [0, 0.0]
+        token = request_db_stats.set(stats)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        requests_in_flight += 1
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            requests_in_flight -= 1
+            request_db_stats.reset(token)
+            labels = (scope["method"], route_label(scope))
+            request_latency.observe(labels, time.perf_counter() - started_at)
+            request_db_statements.observe(labels, stats[0])
+            request_db_time.observe(labels, stats[1])
+            key = labels + (str(status_code),)
+            requests_total[key] = requests_total.get(key, 0) + 1
+
+
+app.add_middleware(InstrumentationMiddleware)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    # Prometheus text exposition format
+    lines = [
+        "# TYPE http_requests_in_flight gauge",
+        f"http_requests_in_flight {requests_in_flight}",
+        "# TYPE http_requests_total counter",
+    ]
+    for key, count in sorted(requests_total.items()):
+        lines.append(f"http_requests_total{format_labels(('method', 'route', 'status'), key)} {count}")
+    for histogram in (request_latency, request_db_statements, request_db_time, operation_time):
+        lines.extend(histogram.render())
+    lines.append("# TYPE login_rejected_total counter")
+    for limit, count in login_rejections.items():
+        lines.append(f'login_rejected_total{{limit="{limit}"}} {count}')
+    lines.append("# TYPE login_limiter_tracked_keys gauge")
+    for limit, limiter in login_limiters.items():
+        lines.append(f'login_limiter_tracked_keys{{limit="{limit}"}} {len(limiter.buckets)}')
+    lines += [
+        "# TYPE token_blacklist_rows_pruned_total counter",
+        f"token_blacklist_rows_pruned_total {token_blacklist_metrics['rows_pruned_total']}",
+        "# TYPE token_blacklist_table_rows gauge",
+        f"token_blacklist_table_rows {token_blacklist_metrics['table_rows']}",
+        "# TYPE token_blacklist_cached_entries gauge",
+        f"token_blacklist_cached_entries {len(token_blacklist)}",
+        "# TYPE token_blacklist_last_sweep_timestamp_seconds gauge",
+        f"token_blacklist_last_sweep_timestamp_seconds {token_blacklist_metrics['last_sweep_timestamp']}",
+    ]
+    for name, value in account_deletion_metrics.items():
+        lines += [f"# TYPE account_deletion_{name} counter", f"account_deletion_{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -169,26 +841,58 @@ class UserResponse(BaseModel):
     email: str
     username: str
 
+class UserBatchResponse(BaseModel):
+    items: List[UserResponse]
+    missing: List[int]
+
+class AccountDeletionResponse(BaseModel):
+    user_id: int
+    username: str
+    status: str
+    posts_total: int
+    posts_deleted: int
+    media_deleted: int
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
 class PostCreate(BaseModel):
     title: str
     content: str
     media_urls: List[dict]
+class PostImport(PostCreate):
+    createtime: Optional[datetime] = None
 class MediaResponse(BaseModel):
      id: int
      file_url: str
      media_type: str
+     thumbnail_url: Optional[str] = None
+     medium_url: Optional[str] = None
      class Config:
         orm_mode = True
+class FeedItem(BaseModel):
+    post_id: int
+    user_id: int
+    username: str
+    title: str
+    cover_image_url: str
+    cover_thumbnail_url: Optional[str] = None
+    createtime: datetime
 class PostResponse(BaseModel):
     id: int
     title: str
     content: str
     cover_image_url: str
+    cover_thumbnail_url: Optional[str] = None
+    cover_medium_url: Optional[str] = None
     createtime: datetime
     user_id: int
     media: List[MediaResponse] = []
     class Config:
         orm_mode = True
+class PostBatchResponse(BaseModel):
+    items: List[PostResponse]
+    missing: List[int]
 
 # Utility functions
 def verify_password(plain_password, hashed_password):
@@ -199,15 +903,529 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+# Password hashing pool. Jobs beyond the workers wait in the executor queue;
+# once running + queued reaches the limit new jobs are rejected with a 503
+# rather than piling up behind a login burst.
+password_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+)
+password_jobs_lock = threading.Lock()
+password_jobs_pending = 0
+
+
+def release_password_job(future: Future):
+    global password_jobs_pending
+    with password_jobs_lock:
+        password_jobs_pending -= 1
+
+
+def submit_password_job(func, *args) -> Future:
+    global password_jobs_pending
+    with password_jobs_lock:
+        if password_jobs_pending >= settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE_LIMIT:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please try again",
+                headers={"Retry-After": "1"},
+            )
+        password_jobs_pending += 1
+    future = password_executor.submit(run_password_job, time.perf_counter(), func, *args)
+    future.add_done_callback(release_password_job)
+    return future
+
+
+def run_password_job(submitted_at: float, func, *args):
+    started_at = time.perf_counter()
+    operation_time.observe(("bcrypt_queue_wait",), started_at - submitted_at)
+    try:
+        return func(*args)
+    finally:
+        operation_time.observe((func.__name__,), time.perf_counter() - started_at)
+
+
+async def verify_password_async(plain_password, hashed_password):
+    return await asyncio.wrap_future(submit_password_job(verify_password, plain_password, hashed_password))
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a TTL."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class TokenBucketLimiter:
+    """Per-key token buckets in bounded memory.
+
+    Buckets are kept in least-recently-used order. A bucket that has been
+    idle long enough to refill completely is the same as no bucket, so idle
+    keys are dropped from the front as requests come in, and the oldest key
+    is evicted once maxkeys is reached.
+    """
+
+    def __init__(self, rate: float, burst: int, maxkeys: int):
+        self.rate = rate
+        self.burst = burst
+        self.maxkeys = maxkeys
+        self.refill_seconds = burst / rate if rate > 0 else float("inf")
+        # key -> (tokens, updated_at)
+        self.buckets: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def acquire(self, key: str) -> float:
+        """Takes one token for key; returns 0, or the seconds until one is available."""
+        now = time.monotonic()
+        with self.lock:
+            while self.buckets:
+                _, (_, updated_at) = next(iter(self.buckets.items()))
+                if now - updated_at < self.refill_seconds:
+                    break
+                self.buckets.popitem(last=False)
+            tokens, updated_at = self.buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate if self.rate > 0 else float("inf")
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.maxkeys:
+                self.buckets.popitem(last=False)
+            return wait
+
+
+login_limiters = {
+    "ip": TokenBucketLimiter(settings.LOGIN_RATE_PER_IP, settings.LOGIN_BURST_PER_IP, settings.LOGIN_LIMITER_MAX_KEYS),
+    "username": TokenBucketLimiter(
+        settings.LOGIN_RATE_PER_USERNAME, settings.LOGIN_BURST_PER_USERNAME, settings.LOGIN_LIMITER_MAX_KEYS
+    ),
+}
+login_rejections = {"ip": 0, "username": 0}
+
+
+def admit_login(request: Request, username: str):
+    # Cheap enough to run before authenticate_user, so rejected attempts never reach bcrypt
+    keys = {"ip": request.client.host if request.client else "unknown", "username": username.lower()}
+    for limit, key in keys.items():
+        wait = login_limiters[limit].acquire(key)
+        if wait > 0:
+            login_rejections[limit] += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many login attempts, please try again later",
+                headers={"Retry-After": str(max(1, math.ceil(min(wait, 3600))))},
+            )
+
+
+# username -> detached User, invalidated by update_user and delete_user
+user_cache = TTLCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL_SECONDS)
+# token -> decoded payload, kept no longer than the token's own exp
+token_cache = TTLCache(settings.TOKEN_CACHE_SIZE, settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+# Rows handed to these come straight from our own tables, so list endpoints
+# build the response dicts directly instead of validating every field through
+# the response models. Keys must match UserResponse, PostResponse and
+# MediaResponse, which still document the endpoints.
+def user_dict(user: User) -> dict:
+    return {"id": user.id, "name": user.name, "email": user.email, "username": user.username}
+
+
+def media_dict(media: Media) -> dict:
+    return {
+        "id": media.id,
+        "file_url": media.file_url,
+        "media_type": media.media_type,
+        "thumbnail_url": media.thumbnail_url,
+        "medium_url": media.medium_url,
+    }
+
+
+def post_dict(post: Post) -> dict:
+    return {
+        "id": post.id,
+        "title": post.title,
+        "content": post.content,
+        "cover_image_url": post.cover_image_url,
+        "cover_thumbnail_url": post.cover_thumbnail_url,
+        "cover_medium_url": post.cover_medium_url,
+        "createtime": post.createtime,
+        "user_id": post.user_id,
+        "media": [media_dict(media) for media in post.media],
+    }
+
+
+def feed_item_dict(entry: TimelineEntry) -> dict:
+    return {
+        "post_id": entry.post_id,
+        "user_id": entry.user_id,
+        "username": entry.username,
+        "title": entry.title,
+        "cover_image_url": entry.cover_image_url,
+        "cover_thumbnail_url": entry.cover_thumbnail_url,
+        "createtime": entry.createtime,
+    }
+
+
+def batch_ids(ids: List[int]) -> List[int]:
+    # Requested order, without duplicates
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > settings.BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.BATCH_MAX_IDS} ids per request")
+    return ids
+
+
+def batch_response(ids: List[int], found: dict, to_dict) -> Response:
+    return FastJSONResponse({
+        "items": [to_dict(found[item_id]) for item_id in ids if item_id in found],
+        "missing": [item_id for item_id in ids if item_id not in found],
+    })
+
+
+def render_json(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(
+        content, default=datetime.isoformat, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse for plain dicts/lists, encoded by render_json."""
+
+    def render(self, content) -> bytes:
+        return render_json(content)
+
+
+class PostResponseCache:
+    """Rendered post GET responses with an ETag validator.
+
+    Entries are keyed by path and query string and remember the generation
+    of the posts' owner when they were built. invalidate() bumps that
+    generation, so a write turns every cached page of the user into a miss
+    without having to find the keys.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.entries = TTLCache(maxsize, ttl)
+        # user id -> generation; None is shared by every user
+        self.generations: Dict[Optional[int], int] = {}
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(request: Request) -> str:
+        return f"{request.url.path}?{request.url.query}"
+
+    def generation(self, user_id: Optional[int]) -> tuple:
+        return (self.generations.get(None, 0), self.generations.get(user_id, 0))
+
+    def invalidate(self, user_id: Optional[int] = None):
+        with self.lock:
+            self.generations[user_id] = self.generations.get(user_id, 0) + 1
+            self.writes += 1
+
+    def lookup(self, request: Request):
+        """Returns (response, token); pass the token to store() on a miss."""
+        entry = self.entries.get(self.key(request))
+        with self.lock:
+            if entry is not None and entry["generation"] == self.generation(entry["user_id"]):
+                return self.respond(request, entry), None
+            return None, self.writes
+
+    def store(self, request: Request, token: int, user_id: int, content, headers: Optional[dict] = None) -> Response:
+        body = render_json(content)
+        entry = {
+            "body": body,
+            "etag": '"' + hashlib.sha256(body).hexdigest()[:32] + '"',
+            "headers": headers or {},
+            "user_id": user_id,
+        }
+        with self.lock:
+            # A write that landed while this response was being built may not be in it
+            if token == self.writes:
+                entry["generation"] = self.generation(user_id)
+                self.entries.set(self.key(request), entry)
+        return self.respond(request, entry)
+
+    @staticmethod
+    def not_modified(request: Request, entry: dict) -> bool:
+        # ETag only: a cache entry's build time is no Last-Modified, since a
+        # post can change within the second (or the worker) that built it
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is None:
+            return False
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or entry["etag"] in tags
+
+    def respond(self, request: Request, entry: dict) -> Response:
+        headers = {
+            "ETag": entry["etag"],
+            # Clients keep the body but check back with If-None-Match every time
+            "Cache-Control": "no-cache",
+        }
+        if self.not_modified(request, entry):
+            return Response(status_code=304, headers=headers)
+        return Response(entry["body"], media_type="application/json", headers={**entry["headers"], **headers})
+
+
+# Invalidated by every handler that writes posts (see post_responses.invalidate calls)
+post_responses = PostResponseCache(settings.RESPONSE_CACHE_SIZE, settings.RESPONSE_CACHE_TTL_SECONDS)
+
+
+class TitleIndex:
+    """Distinct post titles in a sorted array, for prefix lookups with bisect.
+
+    Keys are casefolded titles cut to max_length; each maps to the title as
+    first seen and the number of posts using it, so a title disappears with
+    its last post. Titles beyond max_titles are not indexed until a rebuild
+    finds room.
+
+    last_id is the highest post id read from the table: sync() reads only
+    posts above it, and add() skips posts it already covers. Posts added here
+    before sync() reaches them are kept in local_ids so they count once.
+    """
+
+    def __init__(self, max_titles: int, max_length: int):
+        self.max_titles = max_titles
+        self.max_length = max_length
+        self.keys: List[str] = []
+        self.titles: Dict[str, list] = {}
+        self.last_id = 0
+        self.local_ids: set = set()
+        # Changes made while rebuild() reads the posts table, replayed on top of its result
+        self.journal: Optional[List[tuple]] = None
+        self.lock = threading.Lock()
+
+    def key(self, title: str) -> str:
+        return title[:self.max_length].casefold()
+
+    def apply(self, keys: List[str], titles: Dict[str, list], title: str, delta: int):
+        key = self.key(title)
+        entry = titles.get(key)
+        if entry is None:
+            if delta < 0 or len(keys) >= self.max_titles:
+                return
+            entry = titles[key] = [title[:self.max_length], 0]
+            bisect.insort(keys, key)
+        entry[1] += delta
+        if entry[1] <= 0:
+            del titles[key]
+            del keys[bisect.bisect_left(keys, key)]
+
+    def add(self, post_id: int, title: str):
+        """A new post, by id, so sync() does not count it a second time."""
+        with self.lock:
+            if post_id > self.last_id:
+                self.apply(self.keys, self.titles, title, 1)
+                self.local_ids.add(post_id)
+            if self.journal is not None:
+                self.journal.append((title, 1, post_id))
+
+    def remove(self, title: str):
+        self.change(title, -1)
+
+    def rename(self, old_title: str, new_title: str):
+        self.change(old_title, -1)
+        self.change(new_title, 1)
+
+    def change(self, title: str, delta: int):
+        with self.lock:
+            self.apply(self.keys, self.titles, title, delta)
+            if self.journal is not None:
+                self.journal.append((title, delta, None))
+
+    def sync(self, load_rows):
+        """Adds the posts load_rows(last_id) yields as (id, title), in id order."""
+        rows = load_rows(self.last_id)
+        try:
+            for post_id, title in rows:
+                with self.lock:
+                    if post_id in self.local_ids:
+                        self.local_ids.discard(post_id)
+                    else:
+                        self.apply(self.keys, self.titles, title, 1)
+                    self.last_id = post_id
+        finally:
+            rows.close()
+
+    def rebuild(self, load_rows):
+        """Replaces the contents with the posts load_rows(0) yields as (id, title),
+        in id order. Reading stops at max_titles distinct titles; sync() picks
+        up the rest."""
+        with self.lock:
+            self.journal = []
+        try:
+            counts: Dict[str, list] = {}
+            last_id = 0
+            rows = load_rows(0)
+            try:
+                for post_id, title in rows:
+                    key = self.key(title)
+                    entry = counts.get(key)
+                    if entry is not None:
+                        entry[1] += 1
+                    elif len(counts) < self.max_titles:
+                        counts[key] = [title[:self.max_length], 1]
+                    else:
+                        break
+                    last_id = post_id
+            finally:
+                rows.close()
+            keys = sorted(counts)
+            with self.lock:
+                # New posts up to last_id were read above. A removal or rename
+                # that committed before the read may be counted twice; the
+                # next rebuild corrects it.
+                local_ids = set()
+                for title, delta, post_id in self.journal:
+                    if post_id is None:
+                        self.apply(keys, counts, title, delta)
+                    elif post_id > last_id:
+                        self.apply(keys, counts, title, delta)
+                        local_ids.add(post_id)
+                self.keys, self.titles = keys, counts
+                self.last_id, self.local_ids = last_id, local_ids
+        finally:
+            with self.lock:
+                self.journal = None
+
+    def suggest(self, prefix: str, limit: int) -> List[str]:
+        key = self.key(prefix)
+        with self.lock:
+            start = bisect.bisect_left(self.keys, key)
+            suggestions = []
+            for candidate in self.keys[start:start + limit]:
+                if not candidate.startswith(key):
+                    break
+                suggestions.append(self.titles[candidate][0])
+            return suggestions
+
+
+# Kept current by create_post, the import, update_post and delete_post; the
+# periodic sync picks up posts created by other workers, and the full rebuild
+# drops their deletions and renames
+title_index = TitleIndex(settings.TITLE_INDEX_MAX_TITLES, settings.TITLE_INDEX_MAX_LENGTH)
+
+
+def load_post_titles(after_id: int):
+    # Streamed in id order, so memory stays bounded however many posts there are
+    db = ReadSessionLocal()
+    try:
+        result = db.execute(
+            select(Post.id, Post.title)
+            .where(Post.id > after_id)
+            .order_by(Post.id)
+            .execution_options(yield_per=1000)
+        )
+        for post_id, title in result:
+            yield post_id, title
+    finally:
+        db.close()
+
+
+async def title_index_refresher():
+    rebuilt_at = time.monotonic()
+    while True:
+        await asyncio.sleep(settings.TITLE_INDEX_REFRESH_SECONDS)
+        try:
+            if time.monotonic() - rebuilt_at >= settings.TITLE_INDEX_REBUILD_SECONDS:
+                await asyncio.to_thread(title_index.rebuild, load_post_titles)
+                rebuilt_at = time.monotonic()
+            else:
+                await asyncio.to_thread(title_index.sync, load_post_titles)
+        except Exception as e:
+            print(f"Title index refresh failed: {e}")
+
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def cursor_value(value, expected: type):
+    # bool is an int subclass, but no cursor holds one; SQLite binds 64-bit
+    # integers and finite floats only
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if expected is int and isinstance(value, int) and -2**63 <= value < 2**63:
+        return value
+    if expected is float and isinstance(value, (int, float)) and math.isfinite(value):
+        return float(value)
+    if expected is datetime and isinstance(value, str):
+        return datetime.fromisoformat(value)
+    raise ValueError(value)
+
+
+def decode_cursor(cursor: str, types: tuple) -> list:
+    """The values encode_cursor() stored, checked and converted to types
+    (int, float, or datetime from an ISO string)."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError(values)
+        return [cursor_value(value, expected) for value, expected in zip(values, types)]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def build_match_query(q: str) -> str:
+    # Quote every term so user input can't inject FTS5 syntax, and prefix-match
+    # them so partial words still find results like the old LIKE search did
+    terms = [term.replace('"', '""') for term in q.split()]
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def query_posts(db: Session):
+    # Every post-returning endpoint serializes media; load it in one batched
+    # SELECT ... WHERE post_id IN (...) instead of one query per post
+    return db.query(Post).options(selectinload(Post.media))
+
+
 def get_user(db, username: str):
     return db.query(User).filter(User.username == username).first()
 
 
-def authenticate_user(db, username: str, password: str):
-    user = get_user(db, username)
-    if not user:
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await db.run_sync(get_user, username)
+    # Inactive users include accounts queued for deletion
+    if not user or not user.is_active:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password_async(password, user.hashed_password):
         return False
     return user
 
@@ -249,8 +1467,13 @@ def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None)
 
 
 async def get_token_payload(token: str) -> dict:
+    # Hot tokens skip signature verification; entries die at the token's exp
+    payload = token_cache.get(token)
+    if payload is not None:
+        return dict(payload)
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        token_cache.set(token, dict(payload), ttl=payload.get("exp", 0) - time.time())
         return payload
     except JWTError as e:
         raise HTTPException(
@@ -262,23 +1485,27 @@ async def get_token_payload(token: str) -> dict:
 async def get_current_user(
     request: Request,
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    started_at = time.perf_counter()
     
     try:
+        payload = await get_token_payload(token)
+
         # Verify token is not blacklisted
-        if TokenBlacklist.is_blacklisted(token, db):
+        if token_blacklist_stale():
+            await db.run_sync(sync_token_blacklist)
+        if is_token_revoked(payload.get("jti")):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Token has been revoked"
             )
-            
-        payload = await get_token_payload(token)
+
         username: str = payload.get("sub")
         token_type: str = payload.get("type")
         
@@ -286,10 +1513,14 @@ async def get_current_user(
             raise credentials_exception
             
         token_data = TokenData(username=username)
-        user = get_user(db, username=token_data.username)
-        
+        user = user_cache.get(token_data.username)
         if user is None:
-            raise credentials_exception
+            user = await db.run_sync(get_user, token_data.username)
+            if user is None:
+                raise credentials_exception
+            # Detach so commits in this request don't expire the cached copy
+            db.expunge(user)
+            user_cache.set(token_data.username, user)
             
         # Add token to request state for potential logging or other middleware
         request.state.token_payload = payload
@@ -300,6 +1531,8 @@ async def get_current_user(
         if not isinstance(e, HTTPException):
             raise credentials_exception
         raise e
+    finally:
+        operation_time.observe(("get_current_user",), time.perf_counter() - started_at)
 
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
@@ -316,11 +1549,13 @@ class TokenResponse(Token):
 
 @app.post("/token", response_model=TokenResponse)
 async def login_for_access_token(
+    request: Request,
     response: Response,
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user = authenticate_user(db, form_data.username, form_data.password)
+    admit_login(request, form_data.username)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -362,7 +1597,7 @@ async def login_for_access_token(
 @app.post("/refresh")
 async def refresh_token(
     request: Request,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_routed_db)
 ):
     refresh_token = request.cookies.get("refresh_token")
     if not refresh_token:
@@ -403,7 +1638,7 @@ async def logout(
     request: Request,
     response: Response,
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
         # Add current token to blacklist
@@ -417,7 +1652,8 @@ async def logout(
             expires_at=expires_at
         )
         db.add(blacklisted_token)
-        db.commit()
+        await db.commit()
+        add_revoked_token(jti, expires_at)
         
         # Clear refresh token cookie
         response.delete_cookie("refresh_token")
@@ -433,12 +1669,13 @@ async def logout(
 
 # User endpoints
 @app.post("/users/", response_model=UserInDB)
-def create_user(user: UserCreate, db: Session = Depends(get_db)):
+def create_user(user: UserCreate, db: Session = Depends(get_routed_db)):
     db_user = db.query(User).filter(User.username == user.username).first()
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    hashed_password = get_password_hash(user.password)
+    # Runs on a threadpool worker already; .result() keeps it within the hashing pool's limits
+    hashed_password = submit_password_job(get_password_hash, user.password).result()
     db_user = User(
         name=user.name,
         username=user.username,
@@ -452,16 +1689,36 @@ def create_user(user: UserCreate, db: Session = Depends(get_db)):
 
 
 @app.get("/users/", response_model=list[UserResponse])
-def read_users(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    users = db.query(User).offset(skip).limit(limit).all()
-    return users
+def read_users(
+    limit: int = 10,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_routed_db)
+):
+    limit = max(1, min(limit, 100))
+    query = db.query(User).order_by(User.id)
+    if cursor:
+        (last_id,) = decode_cursor(cursor, (int,))
+        query = query.filter(User.id > last_id)
+    users = query.limit(limit + 1).all()
+    headers = {}
+    if len(users) > limit:
+        users = users[:limit]
+        headers["X-Next-Cursor"] = encode_cursor([users[-1].id])
+    return FastJSONResponse([user_dict(user) for user in users], headers=headers)
+
+@app.get("/users/batch/", response_model=UserBatchResponse)
+def read_users_batch(ids: List[int] = Query(...), db: Session = Depends(get_routed_db)):
+    """Users for ?ids=1&ids=2..., in the requested order, with unknown ids in missing."""
+    ids = batch_ids(ids)
+    found = {user.id: user for user in db.query(User).filter(User.id.in_(ids)).all()}
+    return batch_response(ids, found, user_dict)
 
 @app.get("/users/me", response_model=UserResponse)
 def read_current_user(current_user: User = Depends(get_current_active_user)):
     return current_user
 
 @app.get("/users/{user_id}", response_model=UserResponse)
-def read_user(user_id: int, db: Session = Depends(get_db)):
+def read_user(user_id: int, db: Session = Depends(get_routed_db)):
     user = db.query(User).filter(User.id == user_id).first()
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
@@ -475,25 +1732,208 @@ class UserUpdate(BaseModel):
 # CONTROVERSIAL CODE ALERT: depending on requirement you can change user.name != "" to is not None
 
 @app.put("/users/{user_id}", response_model=UserResponse)
-def update_user(user_id: int, user: UserUpdate, db: Session = Depends(get_db)):
+def update_user(user_id: int, user: UserUpdate, db: Session = Depends(get_routed_db)):
     db_user = db.query(User).filter(User.id == user_id).first()
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
+    old_username = db_user.username
     db_user.name = user.name if user.name is not None else db_user.name
     db_user.username = user.username if user.username is not None else db_user.username
     db_user.email = user.email if user.email is not None else db_user.email
     db.commit()
     db.refresh(db_user)
+    user_cache.pop(old_username)
+    user_cache.pop(db_user.username)
+    post_responses.invalidate(db_user.id)  # post URLs contain the username
     return db_user
 
-@app.delete("/users/{user_id}", response_model=UserResponse)
-def delete_user(user_id:int, db: Session = Depends(get_db)):
+def latest_account_deletion(db: Session, user_id: int) -> Optional[AccountDeletion]:
+    return (
+        db.query(AccountDeletion)
+        .filter(AccountDeletion.user_id == user_id)
+        .order_by(AccountDeletion.id.desc())
+        .first()
+    )
+
+
+def account_deletion_dict(job: AccountDeletion) -> dict:
+    return {
+        "user_id": job.user_id,
+        "username": job.username,
+        "status": job.status,
+        "posts_total": job.posts_total,
+        "posts_deleted": job.posts_deleted,
+        "media_deleted": job.media_deleted,
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def queue_account_deletion(db: Session, user_id: int) -> dict:
     db_user = db.query(User).filter(User.id == user_id).first()
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    db.delete(db_user)
+    job = latest_account_deletion(db, user_id)
+    # A finished job for an existing user means the id was reused
+    if job is None or job.status == "done":
+        posts_total = db.query(func.count(Post.id)).filter(Post.user_id == user_id).scalar()
+        job = AccountDeletion(user_id=user_id, username=db_user.username, status="pending", posts_total=posts_total)
+        db.add(job)
+    elif job.status == "failed":
+        job.status = "pending"
+        job.error = None
+        job.updated_at = datetime.utcnow()
+    # Locks the account out while its posts are being deleted
+    db_user.is_active = False
     db.commit()
-    return db_user
+    return account_deletion_dict(job)
+
+
+account_deletion_metrics = {
+    "jobs_completed_total": 0,
+    "jobs_failed_total": 0,
+    "posts_deleted_total": 0,
+    "media_deleted_total": 0,
+}
+# Set by delete_user so this worker starts on a new job without waiting for the poll
+account_deletion_wakeup: Optional[asyncio.Event] = None
+
+
+def claim_account_deletion() -> Optional[int]:
+    # Queued jobs, and running ones whose worker stopped making progress.
+    # The conditional UPDATE makes sure only one worker gets each job.
+    db = SessionLocal()
+    try:
+        while True:
+            claimable = or_(
+                AccountDeletion.status == "pending",
+                and_(
+                    AccountDeletion.status == "running",
+                    AccountDeletion.updated_at < datetime.utcnow() - timedelta(seconds=settings.ACCOUNT_DELETION_LEASE_SECONDS),
+                ),
+            )
+            job_id = db.execute(
+                select(AccountDeletion.id).where(claimable).order_by(AccountDeletion.id).limit(1)
+            ).scalar()
+            if job_id is None:
+                return None
+            claimed = db.execute(
+                update(AccountDeletion)
+                .where(AccountDeletion.id == job_id, claimable)
+                .values(status="running", updated_at=datetime.utcnow())
+            ).rowcount
+            db.commit()
+            if claimed:
+                return job_id
+    finally:
+        db.close()
+
+
+def delete_account_chunk(job_id: int) -> bool:
+    """Deletes up to ACCOUNT_DELETION_BATCH_SIZE of the user's posts with their
+    media in one transaction, or the user once no posts are left; returns True
+    when the job is done."""
+    db = SessionLocal()
+    try:
+        job = db.get(AccountDeletion, job_id)
+        user_id = job.user_id
+        rows = db.execute(
+            select(Post.id, Post.title).where(Post.user_id == user_id).limit(settings.ACCOUNT_DELETION_BATCH_SIZE)
+        ).all()
+        now = datetime.utcnow()
+        if rows:
+            post_ids = [row.id for row in rows]
+            media_deleted = db.execute(delete(Media).where(Media.post_id.in_(post_ids))).rowcount
+            db.execute(delete(Post).where(Post.id.in_(post_ids)))
+            job.posts_deleted += len(post_ids)
+            job.media_deleted += media_deleted
+            job.updated_at = now
+            db.commit()
+            account_deletion_metrics["posts_deleted_total"] += len(post_ids)
+            account_deletion_metrics["media_deleted_total"] += media_deleted
+            post_responses.invalidate(user_id)
+            for row in rows:
+                title_index.remove(row.title)
+            return False
+        db.execute(delete(User).where(User.id == user_id))
+        # create_post does not check is_active; go round again if one slipped in
+        if db.query(Post.id).filter(Post.user_id == user_id).first() is not None:
+            db.rollback()
+            return False
+        job.status = "done"
+        job.updated_at = now
+        job.finished_at = now
+        db.commit()
+        account_deletion_metrics["jobs_completed_total"] += 1
+        post_responses.invalidate(user_id)
+        return True
+    finally:
+        db.close()
+
+
+def fail_account_deletion(job_id: int, error: Exception):
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(AccountDeletion)
+            .where(AccountDeletion.id == job_id)
+            .values(status="failed", error=str(error)[:500], updated_at=datetime.utcnow())
+        )
+        db.commit()
+    finally:
+        db.close()
+    account_deletion_metrics["jobs_failed_total"] += 1
+
+
+def run_account_deletions():
+    # Small transactions with a pause in between, so deleting a large account
+    # never holds the write lock for long.
+    while True:
+        job_id = claim_account_deletion()
+        if job_id is None:
+            return
+        try:
+            while not delete_account_chunk(job_id):
+                time.sleep(settings.ACCOUNT_DELETION_PAUSE_MS / 1000)
+        except Exception as e:
+            print(f"Account deletion {job_id} failed: {e}")
+            fail_account_deletion(job_id, e)
+
+
+async def account_deletion_worker():
+    # Also resumes jobs interrupted by a restart, on startup
+    global account_deletion_wakeup
+    account_deletion_wakeup = asyncio.Event()
+    while True:
+        try:
+            await asyncio.to_thread(run_account_deletions)
+        except Exception as e:
+            print(f"Account deletion worker failed: {e}")
+        try:
+            await asyncio.wait_for(account_deletion_wakeup.wait(), settings.ACCOUNT_DELETION_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        account_deletion_wakeup.clear()
+
+
+@app.delete("/users/{user_id}", response_model=AccountDeletionResponse, status_code=status.HTTP_202_ACCEPTED)
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Deactivates the user and queues the deletion of their posts, media and
+    account; GET /users/{user_id}/deletion reports the progress."""
+    job = await db.run_sync(queue_account_deletion, user_id)
+    user_cache.pop(job["username"])
+    if account_deletion_wakeup is not None:
+        account_deletion_wakeup.set()
+    return job
+
+
+@app.get("/users/{user_id}/deletion", response_model=AccountDeletionResponse)
+def read_account_deletion(user_id: int, db: Session = Depends(get_routed_db)):
+    job = latest_account_deletion(db, user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No deletion queued for this user")
+    return account_deletion_dict(job)
 
 
 
@@ -502,65 +1942,615 @@ def delete_user(user_id:int, db: Session = Depends(get_db)):
 
 
 
-# Add these two new functions
+# Uploaded media is stored by content hash: static/media/<2 hex>/<sha256><ext>
+MEDIA_DIR = "static/media"
+# Partial uploads, outside the public /static mount but next to it, so that
+# os.replace into MEDIA_DIR stays a rename on the same filesystem
+UPLOAD_TMP_DIR = "uploads.tmp"
+
+
+def clean_upload_tmp_dir():
+    # Left behind by a worker that died mid-upload. Other workers may be
+    # writing here right now, so only files idle for a while are removed.
+    cutoff = time.time() - settings.UPLOAD_TMP_MAX_AGE_SECONDS
+    try:
+        entries = list(os.scandir(UPLOAD_TMP_DIR))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def media_extension(filename: Optional[str]) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if 1 < len(ext) <= 10 and ext[1:].isalnum() else ""
+
+
+class UploadStream:
+    """Streams the "file" field of a multipart body to a temp file.
+
+    The multipart parser callbacks only collect data; flush() hashes and
+    writes it off the event loop, between chunks read from the request.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.filename = None
+        self.found = False
+        self.in_file = False
+        self.headers: Dict[bytes, bytes] = {}
+        self.header_field = b""
+        self.header_value = b""
+        self.pending: List[bytes] = []
+        self.pending_size = 0
+        self.tmp_file = None
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self.headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = b""
+        self.header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self.headers.get(b"content-disposition", b""))
+        if not self.found and options.get(b"name") == b"file" and b"filename" in options:
+            self.found = True
+            self.in_file = True
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if not self.in_file:
+            return
+        self.size += end - start
+        if self.size > self.max_bytes:
+            raise HTTPException(status_code=413, detail="File too large")
+        self.pending.append(data[start:end])
+        self.pending_size += end - start
+
+    def on_part_end(self):
+        self.in_file = False
+
+    def write(self, data: bytes):
+        if self.tmp_file is None:
+            os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+            self.tmp_file = tempfile.NamedTemporaryFile(dir=UPLOAD_TMP_DIR, delete=False)
+        self.hasher.update(data)
+        self.tmp_file.write(data)
+
+    async def flush(self, force: bool = False):
+        if not self.pending or (self.pending_size < settings.UPLOAD_WRITE_BUFFER_BYTES and not force):
+            return
+        data = b"".join(self.pending)
+        self.pending = []
+        self.pending_size = 0
+        await asyncio.to_thread(self.write, data)
+
+    def store(self) -> str:
+        # An identical file already stored under the same hash is reused
+        if self.tmp_file is None:
+            self.write(b"")
+        self.tmp_file.close()
+        digest = self.hasher.hexdigest()
+        directory = os.path.join(MEDIA_DIR, digest[:2])
+        file_path = os.path.join(directory, digest + media_extension(self.filename))
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(file_path):
+            os.remove(self.tmp_file.name)
+        else:
+            os.replace(self.tmp_file.name, file_path)
+            precompress_file(file_path)
+        return "/" + file_path.replace(os.sep, "/")
+
+    def discard(self):
+        if self.tmp_file is not None:
+            self.tmp_file.close()
+            if os.path.exists(self.tmp_file.name):
+                os.remove(self.tmp_file.name)
+
+
+def precompress_file(file_path: str):
+    # Writes <file>.gz (and <file>.br with brotli installed) for MediaStaticFiles,
+    # only when compression actually saves space
+    if os.path.splitext(file_path)[1].lower() not in PRECOMPRESS_EXTENSIONS:
+        return
+    with open(file_path, "rb") as file:
+        data = file.read()
+    compressors = {".gz": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressors[".br"] = lambda data: brotli.compress(data, quality=11)
+    for suffix, compress in compressors.items():
+        compressed = compress(data)
+        if len(compressed) < len(data) * 0.9:
+            os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=UPLOAD_TMP_DIR, delete=False) as file:
+                file.write(compressed)
+            os.replace(file.name, file_path + suffix)
+
+
+# Image variants live next to the original: <sha256>.thumb.webp, <sha256>.medium.webp
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp"}
+image_executor: Optional[ProcessPoolExecutor] = None
+image_jobs_lock = threading.Lock()
+image_jobs: set = set()
+
+
+def image_variant_urls(file_url: Optional[str]) -> Optional[Dict[str, str]]:
+    # Only content-addressed uploads get variants; their names never change
+    if not file_url or not file_url.startswith(f"/{MEDIA_DIR}/"):
+        return None
+    stem, ext = os.path.splitext(file_url)
+    if ext.lower() not in IMAGE_EXTENSIONS:
+        return None
+    variant_ext = ".webp" if settings.IMAGE_VARIANT_FORMAT.lower() == "webp" else ".jpg"
+    return {
+        "thumbnail": f"{stem}.thumb{variant_ext}",
+        "medium": f"{stem}.medium{variant_ext}",
+    }
+
+
+def existing_image_variants(file_url: Optional[str]) -> Dict[str, Optional[str]]:
+    urls = image_variant_urls(file_url)
+    if urls and all(os.path.exists(url.lstrip("/")) for url in urls.values()):
+        return urls
+    return {"thumbnail": None, "medium": None}
+
+
+def make_image_variants(source_path: str, outputs: List[tuple]):
+    # Runs in a worker process
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        for path, width in outputs:
+            variant = image.copy()
+            variant.thumbnail((width, width * 4))
+            if path.endswith(".jpg") and variant.mode == "RGBA":
+                variant = variant.convert("RGB")
+            os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_TMP_DIR)
+            os.close(fd)
+            variant.save(tmp_path, format="WEBP" if path.endswith(".webp") else "JPEG", quality=80)
+            os.replace(tmp_path, path)
+
+
+def record_image_variants(file_url: str, future: Future):
+    with image_jobs_lock:
+        image_jobs.discard(file_url)
+    if future.cancelled() or future.exception() is not None:
+        if not future.cancelled():
+            print(f"Could not create image variants for {file_url}: {future.exception()}")
+            if isinstance(future.exception(), BrokenProcessPool):
+                shutdown_image_executor()  # recreated on the next job
+        return
+    urls = image_variant_urls(file_url)
+    db = SessionLocal()
+    try:
+        db.query(Media).filter(Media.file_url == file_url).update(
+            {"thumbnail_url": urls["thumbnail"], "medium_url": urls["medium"]}, synchronize_session=False
+        )
+        post_ids = select(Media.post_id).where(Media.file_url == file_url)
+        db.query(Post).filter(Post.id.in_(post_ids), Post.cover_image_url == file_url).update(
+            {"cover_thumbnail_url": urls["thumbnail"], "cover_medium_url": urls["medium"]}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+    # The file may be shared by posts of several users
+    post_responses.invalidate()
+
+
+def schedule_image_variants(file_url: str):
+    global image_executor
+    urls = image_variant_urls(file_url)
+    if Image is None or urls is None or existing_image_variants(file_url)["thumbnail"]:
+        return
+    with image_jobs_lock:
+        # Skip when busy; create_post schedules again if variants are still missing
+        if file_url in image_jobs or len(image_jobs) >= settings.IMAGE_WORKERS + settings.IMAGE_QUEUE_LIMIT:
+            return
+        image_jobs.add(file_url)
+        if image_executor is None:
+            # spawn: forking a process that already runs threads is unsafe
+            image_executor = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+    outputs = [
+        (urls["thumbnail"].lstrip("/"), settings.IMAGE_THUMBNAIL_WIDTH),
+        (urls["medium"].lstrip("/"), settings.IMAGE_MEDIUM_WIDTH),
+    ]
+    future = image_executor.submit(make_image_variants, file_url.lstrip("/"), outputs)
+    future.add_done_callback(lambda done: record_image_variants(file_url, done))
+
+
+def shutdown_image_executor():
+    global image_executor
+    if image_executor is not None:
+        image_executor.shutdown(wait=False, cancel_futures=True)
+        image_executor = None
+
+
 @app.post("/upload/")
-async def upload_file(file: UploadFile = File(...)):
-    file_path = f"static/{file.filename}"
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    return {"file_url": f"/{file_path}"}
+async def upload_file(request: Request):
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+    # Refuse early when the client declares an oversized body (allowing for multipart overhead)
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > settings.UPLOAD_MAX_BYTES + 64 * 1024:
+        raise HTTPException(status_code=413, detail="File too large")
+
+    upload = UploadStream(settings.UPLOAD_MAX_BYTES)
+    parser = multipart.MultipartParser(params[b"boundary"], upload.callbacks())
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            await upload.flush()
+        parser.finalize()
+        await upload.flush(force=True)
+        if not upload.found:
+            raise HTTPException(status_code=400, detail="No file uploaded")
+        file_url = await asyncio.to_thread(upload.store)
+    finally:
+        await asyncio.to_thread(upload.discard)
+    schedule_image_variants(file_url)
+    return {"file_url": file_url}
+
+@app.get("/feed/", response_model=List[FeedItem])
+def read_feed(
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_routed_db)
+):
+    """Newest posts of all users, from the timeline table."""
+    limit = max(1, min(limit, 100))
+    # Walks ix_timeline_createtime_post_id backwards; no join with users or media
+    query = db.query(TimelineEntry).order_by(TimelineEntry.createtime.desc(), TimelineEntry.post_id.desc())
+    if cursor:
+        createtime, last_id = decode_cursor(cursor, (datetime, int))
+        query = query.filter(tuple_(TimelineEntry.createtime, TimelineEntry.post_id) < tuple_(createtime, last_id))
+    entries = query.limit(limit + 1).all()
+    headers = {}
+    if len(entries) > limit:
+        entries = entries[:limit]
+        headers["X-Next-Cursor"] = encode_cursor([entries[-1].createtime.isoformat(), entries[-1].post_id])
+    return FastJSONResponse([feed_item_dict(entry) for entry in entries], headers=headers)
+
+
+@app.get("/posts/batch/", response_model=PostBatchResponse)
+def read_posts_batch(ids: List[int] = Query(...), db: Session = Depends(get_routed_db)):
+    """Posts with their media for ?ids=1&ids=2..., in the requested order, with unknown ids in missing."""
+    ids = batch_ids(ids)
+    found = {post.id: post for post in query_posts(db).filter(Post.id.in_(ids)).all()}
+    return batch_response(ids, found, post_dict)
+
+
+@app.get("/posts/autocomplete/", response_model=List[str])
+def autocomplete_titles(q: str, limit: int = 10):
+    """Post titles starting with q (case-insensitive), from the in-memory title index."""
+    if not q.strip():
+        return FastJSONResponse([])
+    return FastJSONResponse(title_index.suggest(q, max(1, min(limit, 50))))
+
 
 @app.get("/posts/search/", response_model=List[PostResponse])
-def search_posts(q: str, db: Session = Depends(get_db)):
-    posts = db.query(Post).filter(Post.title.contains(q) | Post.content.contains(q)).all()
-    return posts
+def search_posts(
+    q: str,
+    limit: int = 10,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_routed_db)
+):
+    limit = max(1, min(limit, 100))
+    match_query = build_match_query(q)
+    if not match_query:
+        return []
+
+    if search_index_enabled:
+        # Best matches first (lower bm25 is better), id breaks ties
+        params = {"match": match_query, "limit": limit + 1}
+        after = ""
+        if cursor:
+            score, post_id = decode_cursor(cursor, (float, int))
+            params.update({"score": score, "post_id": post_id})
+            after = "WHERE score > :score OR (score = :score AND id > :post_id)"
+        rows = db.execute(text(f"""
+            SELECT id, score FROM (
+                SELECT rowid AS id, bm25(posts_fts) AS score
+                FROM posts_fts WHERE posts_fts MATCH :match
+            ) {after}
+            ORDER BY score, id
+            LIMIT :limit
+        """), params).all()
+    else:
+        query = db.query(Post.id, Post.id).filter(Post.title.contains(q) | Post.content.contains(q))
+        if cursor:
+            query = query.filter(Post.id > decode_cursor(cursor, (float, int))[1])
+        rows = query.order_by(Post.id).limit(limit + 1).all()
+
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = encode_cursor([rows[-1][1], rows[-1][0]])
+
+    ids = [row[0] for row in rows]
+    posts_by_id = {post.id: post for post in query_posts(db).filter(Post.id.in_(ids)).all()}
+    return FastJSONResponse(
+        [post_dict(posts_by_id[post_id]) for post_id in ids if post_id in posts_by_id], headers=headers
+    )
+
+
+
+def build_post_rows(user_id: int, post: PostCreate, createtime: Optional[datetime] = None):
+    """Column values for a new post and its media rows (without post_id)."""
+    for media_item in post.media_urls:
+        for field in ("file_url", "media_type"):
+            value = media_item.get(field)
+            if not isinstance(value, str) or not value:
+                raise ValueError(f"Every media item needs a {field} string.")
+    # Find the first image URL to use as the cover image
+    first_image_url = next((media.get("file_url") for media in post.media_urls if media.get("media_type") == "image"), None)
+    if not first_image_url:
+        raise ValueError("At least one image is required.")
+
+    # Stored as naive UTC like datetime.utcnow(), so imported posts sort with the rest
+    if createtime is not None and createtime.tzinfo is not None:
+        createtime = createtime.astimezone(timezone.utc).replace(tzinfo=None)
+
+    # Variants not built yet are filled in when their job finishes
+    cover_variants = existing_image_variants(first_image_url)
+    post_row = {
+        "title": post.title,
+        "content": post.content,
+        "user_id": user_id,
+        "cover_image_url": first_image_url,
+        "cover_thumbnail_url": cover_variants["thumbnail"],
+        "cover_medium_url": cover_variants["medium"],
+        "createtime": createtime or datetime.utcnow(),
+    }
+    media_rows = []
+    for media_item in post.media_urls:
+        variants = existing_image_variants(media_item.get("file_url"))
+        media_rows.append({
+            "file_url": media_item.get("file_url"),
+            "media_type": media_item.get("media_type"),
+            "thumbnail_url": variants["thumbnail"],
+            "medium_url": variants["medium"],
+        })
+    return post_row, media_rows
+
+
+def schedule_post_image_variants(post: PostCreate):
+    for media_item in post.media_urls:
+        if media_item.get("media_type") == "image":
+            schedule_image_variants(media_item.get("file_url"))
 
 
+def insert_post_batch(batch: List[tuple]) -> int:
+    # batch: [(PostCreate, (post_row, media_rows))], written in one transaction
+    db = SessionLocal()
+    try:
+        post_ids = db.execute(
+            insert(Post).returning(Post.id, sort_by_parameter_order=True),
+            [post_row for _, (post_row, _) in batch],
+        ).scalars().all()
+        media = [
+            dict(row, post_id=post_id)
+            for post_id, (_, (_, media_rows)) in zip(post_ids, batch)
+            for row in media_rows
+        ]
+        if media:
+            db.execute(insert(Media), media)
+        db.commit()
+    finally:
+        db.close()
+    for post_id, (post, _) in zip(post_ids, batch):
+        title_index.add(post_id, post.title)
+        schedule_post_image_variants(post)
+    return len(post_ids)
+
 
 @app.post("/{user_name}/posts/", response_model=PostResponse)
-def create_post(user_name: str, post: PostCreate, db: Session = Depends(get_db)):
+def create_post(user_name: str, post: PostCreate, db: Session = Depends(get_routed_db)):
     user = db.query(User).filter(User.username == user_name).first()
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Find the first image URL to use as the cover image
-    first_image_url = next((media.get("file_url") for media in post.media_urls if media.get("media_type") == "image"), None)
-    if not first_image_url:
-        raise HTTPException(status_code=400, detail="At least one image is required.")
+    try:
+        post_row, media_rows = build_post_rows(user.id, post)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    # Create the Post object
-    db_post = Post(title=post.title, content=post.content, user_id=user.id, cover_image_url=first_image_url)
+    # One transaction: the post, then all of its media in a single executemany
+    db_post = Post(**post_row)
     db.add(db_post)
+    db.flush()
+    post_id = db_post.id
+    if media_rows:
+        db.execute(insert(Media), [dict(row, post_id=post_id) for row in media_rows])
     db.commit()
-    db.refresh(db_post)
+    post_responses.invalidate(user.id)
+    title_index.add(post_id, post.title)
+    schedule_post_image_variants(post)
 
-    # Create and link the Media objects
-    for media_item in post.media_urls:
-        db_media = Media(post_id=db_post.id, file_url=media_item.get("file_url"), media_type=media_item.get("media_type"))
-        db.add(db_media)
-    db.commit()
-
-    # Query the post again to ensure the media relationship is loaded
-    final_post = db.query(Post).filter(Post.id == db_post.id).first()
+    # Load the post with its media for the response
+    final_post = query_posts(db).filter(Post.id == post_id).first()
     return final_post
 
+
+@app.post("/{user_name}/posts/import")
+async def import_posts(
+    user_name: str,
+    request: Request,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Bulk-create posts from an NDJSON body, one PostImport object per line.
+
+    Lines are parsed as they stream in and written IMPORT_BATCH_SIZE posts
+    per transaction. Invalid lines, and lines longer than
+    IMPORT_MAX_LINE_BYTES, are skipped and reported.
+    """
+    if current_user.username != user_name:
+        raise HTTPException(status_code=403, detail="Not authorized to import posts for this user")
+
+    imported = 0
+    errors = []
+    batch = []
+    line_number = 0
+    # The unfinished last line: its pieces so far, or None once it is too long
+    partial: Optional[List[bytes]] = []
+    partial_size = 0
+
+    def report(detail: str):
+        if len(errors) < 100:
+            errors.append({"line": line_number, "detail": detail})
+
+    def parse_line(line: Optional[bytes]):
+        nonlocal line_number
+        line_number += 1
+        if line is None or len(line) > settings.IMPORT_MAX_LINE_BYTES:
+            report(f"Line longer than {settings.IMPORT_MAX_LINE_BYTES} bytes")
+            return
+        if not line.strip():
+            return
+        try:
+            post = PostImport.parse_raw(line)
+            batch.append((post, build_post_rows(current_user.id, post, createtime=post.createtime)))
+        except Exception as e:
+            report(str(e).splitlines()[0])
+
+    async for chunk in request.stream():
+        # Only the new chunk is split; earlier data is never rescanned
+        *lines, rest = chunk.split(b"\n")
+        if lines:
+            parse_line(None if partial is None else b"".join(partial + [lines[0]]))
+            for line in lines[1:]:
+                parse_line(line)
+            partial, partial_size = [], 0
+        if partial is not None:
+            partial_size += len(rest)
+            if partial_size > settings.IMPORT_MAX_LINE_BYTES:
+                partial = None
+            elif rest:
+                partial.append(rest)
+        if len(batch) >= settings.IMPORT_BATCH_SIZE:
+            imported += await asyncio.to_thread(insert_post_batch, batch)
+            post_responses.invalidate(current_user.id)
+            batch = []
+    if partial is None or partial:
+        parse_line(None if partial is None else b"".join(partial))
+    if batch:
+        imported += await asyncio.to_thread(insert_post_batch, batch)
+        post_responses.invalidate(current_user.id)
+    return {"imported": imported, "errors": errors}
+
+def export_post_lines(user_id: int):
+    # Core rows rather than ORM objects, so nothing accumulates in an identity
+    # map; memory stays at one batch of posts plus their media
+    db = ReadSessionLocal()
+    try:
+        posts = db.execute(
+            select(Post.__table__)
+            .where(Post.user_id == user_id)
+            .order_by(Post.createtime, Post.id)
+            .execution_options(yield_per=settings.EXPORT_BATCH_SIZE)
+        ).mappings()
+        for batch in posts.partitions():
+            media_by_post: Dict[int, list] = {}
+            media_rows = db.execute(
+                select(Media.id, Media.post_id, Media.file_url, Media.media_type, Media.thumbnail_url, Media.medium_url)
+                .where(Media.post_id.in_([post["id"] for post in batch]))
+                .order_by(Media.id)
+            ).mappings()
+            for media in media_rows:
+                media = dict(media)
+                media_by_post.setdefault(media.pop("post_id"), []).append(media)
+            lines = []
+            for post in batch:
+                post = dict(post)
+                post["createtime"] = post["createtime"].isoformat()
+                post["media"] = media_by_post.get(post["id"], [])
+                lines.append(json.dumps(post) + "\n")
+            yield "".join(lines)
+    finally:
+        db.close()
+
+
+@app.get("/{user_name}/export")
+def export_posts(user_name: str, db: Session = Depends(get_routed_db)):
+    """Stream every post of a user, with its media, as NDJSON."""
+    user = db.query(User).filter(User.username == user_name).first()
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return StreamingResponse(
+        export_post_lines(user.id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{user_name}-posts.ndjson"'},
+    )
+
+
 @app.get("/{user_name}/posts/", response_model = list[PostResponse])
-def read_posts(user_name: str, skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
+def read_posts(
+    user_name: str,
+    request: Request,
+    limit: int = 10,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_routed_db)
+):
+    cached, token = post_responses.lookup(request)
+    if cached is not None:
+        return cached
+    limit = max(1, min(limit, 100))
     user = db.query(User).filter(User.username == user_name).first()
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    posts = db.query(Post).filter(Post.user_id == user.id).offset(skip).limit(limit).all()
-    return posts
+    # Seeks into ix_posts_user_id_createtime_id, so deep pages cost the same as the first
+    query = query_posts(db).filter(Post.user_id == user.id).order_by(Post.createtime, Post.id)
+    if cursor:
+        createtime, last_id = decode_cursor(cursor, (datetime, int))
+        query = query.filter(tuple_(Post.createtime, Post.id) > tuple_(createtime, last_id))
+    posts = query.limit(limit + 1).all()
+    headers = {}
+    if len(posts) > limit:
+        posts = posts[:limit]
+        headers["X-Next-Cursor"] = encode_cursor([posts[-1].createtime.isoformat(), posts[-1].id])
+    return post_responses.store(request, token, user.id, [post_dict(post) for post in posts], headers)
 
 @app.get("/{user_name}/posts/{post_title}", response_model = PostResponse)
-def read_post(user_name: str, post_title: str, db: Session = Depends(get_db)):
+def read_post(user_name: str, post_title: str, request: Request, db: Session = Depends(get_routed_db)):
+    cached, token = post_responses.lookup(request)
+    if cached is not None:
+        return cached
     user = db.query(User).filter(User.username == user_name).first()
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    post = db.query(Post).filter(Post.title == post_title and Post.user_id == user.id).first()
+    post = query_posts(db).filter(Post.user_id == user.id, Post.title == post_title).first()
     if post is None:
         raise HTTPException(status_code=404, detail="Post not found")
-    return post
+    return post_responses.store(request, token, user.id, post_dict(post))
 
 class PostUpdate(BaseModel):
     title:Optional[str] = None
@@ -568,20 +2558,24 @@ class PostUpdate(BaseModel):
 
 # Add this endpoint to your main.py, for example, after the other post-related routes.
 @app.get("/posts/{post_id}", response_model=PostResponse)
-def read_post_by_id(post_id: int, db: Session = Depends(get_db)):
-    post = db.query(Post).filter(Post.id == post_id).first()
+def read_post_by_id(post_id: int, request: Request, db: Session = Depends(get_routed_db)):
+    cached, token = post_responses.lookup(request)
+    if cached is not None:
+        return cached
+    post = query_posts(db).filter(Post.id == post_id).first()
     if post is None:
         raise HTTPException(status_code=404, detail="Post not found")
-    return post
+    return post_responses.store(request, token, post.user_id, post_dict(post))
 # In main.py, replace the old update_post function
 
 @app.put("/posts/{post_id}", response_model=PostResponse)
 def update_post(
     post_id: int, 
     post: PostUpdate, 
-    db: Session = Depends(get_db), 
+    db: Session = Depends(get_routed_db), 
     current_user: User = Depends(get_current_user)
 ):
+    # Media is reloaded after the commit below, so don't eager-load it here
     db_post = db.query(Post).filter(Post.id == post_id).first()
 
     if not db_post:
@@ -592,23 +2586,30 @@ def update_post(
         raise HTTPException(status_code=403, detail="Not authorized to edit this post")
 
     # Update fields if they are provided
+    old_title = db_post.title
     if post.title is not None:
         db_post.title = post.title
     if post.content is not None:
         db_post.content = post.content
     
     db.commit()
+    post_responses.invalidate(db_post.user_id)
+    if post.title is not None and post.title != old_title:
+        title_index.rename(old_title, post.title)
     db.refresh(db_post)
     return db_post
 
 @app.delete("/{user_name}/posts/{post_id}", response_model=PostResponse)
-def delete_post(user_name: str, post_id:int, db: Session = Depends(get_db)):
+def delete_post(user_name: str, post_id:int, db: Session = Depends(get_routed_db)):
     user = db.query(User).filter(User.username == user_name).first()
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    db_post = db.query(Post).filter(Post.id == post_id and Post.user_id == user.id).first()
+    db_post = query_posts(db).filter(Post.id == post_id, Post.user_id == user.id).first()
     if db_post is None:
         raise HTTPException(status_code=404, detail="User not found")
+    title = db_post.title
     db.delete(db_post)
     db.commit()
+    post_responses.invalidate(user.id)
+    title_index.remove(title)
     return db_post
@@ -1,17 +1,24 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey
+import os
+import sys
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text, Column, Index, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql.sqltypes import TIMESTAMP
 from datetime import datetime
 
-# Database configuration
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+# Database configuration: the same DATABASE_URL (environment or .env) as main.py
+load_dotenv()
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test.db")
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 Base = declarative_base()
 
-# Define models directly here to avoid circular imports
+# Define models directly here to avoid circular imports (keep in sync with main.py)
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
@@ -25,21 +32,322 @@ class User(Base):
 class Post(Base):
     __tablename__ = "posts"
     id = Column(Integer, primary_key=True, index=True)
-    title = Column(String, index=True)
-    content = Column(String, index=True)
-    createtime = Column(DateTime, default=datetime.utcnow)
+    title = Column(String, nullable=False)
+    content = Column(String)
+    cover_image_url = Column(String, nullable=False)
+    cover_thumbnail_url = Column(String, nullable=True)
+    cover_medium_url = Column(String, nullable=True)
+    createtime = Column(TIMESTAMP(timezone=True), nullable=False, default=datetime.utcnow)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     user = relationship("User", back_populates="posts")
+    media = relationship("Media", back_populates="post", cascade="all, delete-orphan")
+    __table_args__ = (
+        Index("ix_posts_user_id_createtime_id", "user_id", "createtime", "id"),
+        Index("ix_posts_user_id_title", "user_id", "title"),
+        {"sqlite_autoincrement": True},
+    )
+
+class Media(Base):
+    __tablename__ = "media"
+    id = Column(Integer, primary_key=True, index=True)
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), nullable=False, index=True)
+    file_url = Column(String, nullable=False, index=True)
+    media_type = Column(String, nullable=False)
+    thumbnail_url = Column(String, nullable=True)
+    medium_url = Column(String, nullable=True)
+    post = relationship("Post", back_populates="media")
+
+class TimelineEntry(Base):
+    __tablename__ = "timeline"
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    username = Column(String, nullable=False)
+    title = Column(String, nullable=False)
+    cover_image_url = Column(String, nullable=False)
+    cover_thumbnail_url = Column(String, nullable=True)
+    createtime = Column(TIMESTAMP(timezone=True), nullable=False)
+    __table_args__ = (
+        Index("ix_timeline_createtime_post_id", "createtime", "post_id"),
+    )
+
+class TokenBlacklist(Base):
+    __tablename__ = "token_blacklist"
+    id = Column(Integer, primary_key=True, index=True)
+    jti = Column(String, unique=True, index=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = {"sqlite_autoincrement": True}
+
+class AccountDeletion(Base):
+    __tablename__ = "account_deletions"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    username = Column(String, nullable=False)
+    status = Column(String, nullable=False, index=True)
+    posts_total = Column(Integer, nullable=False, default=0)
+    posts_deleted = Column(Integer, nullable=False, default=0)
+    media_deleted = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+# Full-text search index over posts. posts_fts is an FTS5 external content
+# table that reads title/content from posts; the triggers keep it in sync on
+# every insert, update and delete (create_post, update_post, delete_post).
+SEARCH_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+        title, content, content='posts', content_rowid='id'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_ai AFTER INSERT ON posts BEGIN
+        INSERT INTO posts_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_ad AFTER DELETE ON posts BEGIN
+        INSERT INTO posts_fts(posts_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_au AFTER UPDATE OF title, content ON posts BEGIN
+        INSERT INTO posts_fts(posts_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO posts_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+]
+
+def create_search_index(conn):
+    try:
+        for statement in SEARCH_INDEX_DDL:
+            conn.execute(text(statement))
+        conn.execute(text("INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')"))
+    except OperationalError as e:
+        # main.py falls back to LIKE search when posts_fts is missing
+        print(f"Skipping full-text search index, FTS5 unavailable: {e.orig}")
+
+# Home feed. timeline holds the fields the feed shows for every post; these
+# triggers maintain it on every post insert, update and delete, and follow
+# username changes and deleted users.
+TIMELINE_DDL = [
+    """CREATE TRIGGER IF NOT EXISTS timeline_ai AFTER INSERT ON posts BEGIN
+        INSERT OR REPLACE INTO timeline(post_id, user_id, username, title, cover_image_url, cover_thumbnail_url, createtime)
+        SELECT new.id, new.user_id, users.username, new.title, new.cover_image_url, new.cover_thumbnail_url, new.createtime
+        FROM users WHERE users.id = new.user_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS timeline_ad AFTER DELETE ON posts BEGIN
+        DELETE FROM timeline WHERE post_id = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS timeline_au AFTER UPDATE OF title, cover_image_url, cover_thumbnail_url, createtime ON posts BEGIN
+        UPDATE timeline SET title = new.title, cover_image_url = new.cover_image_url,
+            cover_thumbnail_url = new.cover_thumbnail_url, createtime = new.createtime
+        WHERE post_id = new.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS timeline_users_au AFTER UPDATE OF username ON users BEGIN
+        UPDATE timeline SET username = new.username WHERE user_id = new.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS timeline_users_ad AFTER DELETE ON users BEGIN
+        DELETE FROM timeline WHERE user_id = old.id;
+    END""",
+]
+
+def create_timeline(conn):
+    TimelineEntry.__table__.create(bind=conn, checkfirst=True)
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_timeline_createtime_post_id ON timeline (createtime, post_id)"))
+    for statement in TIMELINE_DDL:
+        conn.execute(text(statement))
+    # Backfill existing posts (posts of deleted users are left out)
+    conn.execute(text("""
+        INSERT OR IGNORE INTO timeline(post_id, user_id, username, title, cover_image_url, cover_thumbnail_url, createtime)
+        SELECT posts.id, posts.user_id, users.username, posts.title, posts.cover_image_url, posts.cover_thumbnail_url, posts.createtime
+        FROM posts JOIN users ON users.id = posts.user_id
+    """))
+
+def rebuild_with_autoincrement(conn, table: str, triggers=()):
+    # Without AUTOINCREMENT SQLite hands out the ids of deleted newest rows
+    # again, which breaks anything that syncs on "id > last seen id". SQLite
+    # can't add it in place, so the table is rebuilt from the model with its
+    # rows, ids and indexes; triggers on it are dropped with the old table
+    # and recreated from the given DDL.
+    sql = conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table}
+    ).scalar()
+    if sql is None or "AUTOINCREMENT" in sql.upper():
+        return
+    # Legacy mode leaves other tables' REFERENCES pointing at the name, not the renamed old table
+    conn.execute(text("PRAGMA legacy_alter_table = ON"))
+    try:
+        conn.execute(text(f"ALTER TABLE {table} RENAME TO {table}_old"))
+    finally:
+        conn.execute(text("PRAGMA legacy_alter_table = OFF"))
+    # Free the index names for the new table (autoindexes go with the table)
+    for _, name, _, origin, _ in conn.execute(text(f"PRAGMA index_list({table}_old)")).all():
+        if origin == "c":
+            conn.execute(text(f'DROP INDEX "{name}"'))
+    model = Base.metadata.tables[table]
+    model.create(bind=conn)
+    columns = ", ".join(column.name for column in model.columns)
+    conn.execute(text(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {table}_old"))
+    conn.execute(text(f"DROP TABLE {table}_old"))
+    for statement in triggers:
+        conn.execute(text(statement))
+
+def rebuild_posts_with_autoincrement(conn):
+    # The autocomplete index syncs on posts.id > last seen id, like the token blacklist
+    has_search_index = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'posts_fts'")).first() is not None
+    triggers = (SEARCH_INDEX_DDL if has_search_index else []) + TIMELINE_DDL
+    rebuild_with_autoincrement(conn, "posts", triggers)
+
+def add_column(conn, table: str, column: str, column_type: str):
+    # SQLite has no ADD COLUMN IF NOT EXISTS
+    columns = [row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))]
+    if column not in columns:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+
+# Versioned migrations. The applied version is stored in PRAGMA user_version;
+# each step is a SQL string or a callable taking the connection. Steps must
+# be idempotent since databases created by older versions of main.py may
+# already have some of these objects.
+MIGRATIONS = [
+    (1, "create base tables", [
+        lambda conn: Base.metadata.create_all(bind=conn),
+    ]),
+    (2, "full-text search index for posts", [
+        create_search_index,
+    ]),
+    (3, "index token_blacklist.expires_at for the expiry sweeper", [
+        "CREATE INDEX IF NOT EXISTS ix_token_blacklist_expires_at ON token_blacklist (expires_at)",
+    ]),
+    (4, "keyset pagination index for posts", [
+        "CREATE INDEX IF NOT EXISTS ix_posts_user_id_createtime_id ON posts (user_id, createtime, id)",
+    ]),
+    (5, "index audit: drop free-text indexes, index access paths", [
+        # Free text is searched through posts_fts; these only slowed inserts down
+        "DROP INDEX IF EXISTS ix_posts_content",
+        "DROP INDEX IF EXISTS ix_posts_title",
+        "CREATE INDEX IF NOT EXISTS ix_posts_user_id_title ON posts (user_id, title)",
+        "CREATE INDEX IF NOT EXISTS ix_media_post_id ON media (post_id)",
+    ]),
+    (6, "image variant columns for media and post covers", [
+        lambda conn: add_column(conn, "media", "thumbnail_url", "VARCHAR"),
+        lambda conn: add_column(conn, "media", "medium_url", "VARCHAR"),
+        lambda conn: add_column(conn, "posts", "cover_thumbnail_url", "VARCHAR"),
+        lambda conn: add_column(conn, "posts", "cover_medium_url", "VARCHAR"),
+        # Lets a finished image job find the rows that reference its file
+        "CREATE INDEX IF NOT EXISTS ix_media_file_url ON media (file_url)",
+    ]),
+    (7, "home feed timeline", [
+        create_timeline,
+    ]),
+    (8, "background account deletion jobs", [
+        lambda conn: AccountDeletion.__table__.create(bind=conn, checkfirst=True),
+    ]),
+    (9, "never reuse token_blacklist ids (workers sync on id > last seen)", [
+        lambda conn: rebuild_with_autoincrement(conn, "token_blacklist"),
+    ]),
+    (10, "never reuse posts ids (the title index syncs on id > last seen)", [
+        rebuild_posts_with_autoincrement,
+    ]),
+]
+
+# The queries each endpoint runs, with placeholder parameters, for EXPLAIN QUERY PLAN
+ENDPOINT_QUERIES = [
+    ("get_user / get_current_user", "SELECT * FROM users WHERE username = :username LIMIT 1",
+        {"username": "someone"}),
+    ("read_users", "SELECT * FROM users WHERE id > :id ORDER BY id LIMIT 11",
+        {"id": 0}),
+    ("read_posts", "SELECT * FROM posts WHERE user_id = :user_id AND (createtime, id) > (:createtime, :id) ORDER BY createtime, id LIMIT 11",
+        {"user_id": 1, "createtime": "2024-01-01 00:00:00", "id": 0}),
+    ("read_post", "SELECT * FROM posts WHERE user_id = :user_id AND title = :title LIMIT 1",
+        {"user_id": 1, "title": "title"}),
+    ("read_post_by_id / update_post", "SELECT * FROM posts WHERE id = :id",
+        {"id": 1}),
+    ("post media (selectinload)", "SELECT * FROM media WHERE post_id IN (:a, :b)",
+        {"a": 1, "b": 2}),
+    ("search_posts", "SELECT rowid, bm25(posts_fts) FROM posts_fts WHERE posts_fts MATCH :q ORDER BY 2 LIMIT 11",
+        {"q": '"word"*'}),
+    ("read_feed", "SELECT * FROM timeline WHERE (createtime, post_id) < (:createtime, :id) ORDER BY createtime DESC, post_id DESC LIMIT 21",
+        {"createtime": "2024-01-01 00:00:00", "id": 0}),
+    ("account deletion chunk", "SELECT id, title FROM posts WHERE user_id = :user_id LIMIT 200",
+        {"user_id": 1}),
+    ("account deletion claim", "SELECT id FROM account_deletions WHERE status = 'pending' OR (status = 'running' AND updated_at < :cutoff) ORDER BY id LIMIT 1",
+        {"cutoff": "2024-01-01 00:00:00"}),
+    ("token blacklist sweep", "SELECT id FROM token_blacklist WHERE expires_at < :now LIMIT 1000",
+        {"now": "2024-01-01 00:00:00"}),
+]
+
+def get_schema_version(conn) -> int:
+    return conn.execute(text("PRAGMA user_version")).scalar()
+
+def explain_queries() -> dict:
+    plans = {}
+    with engine.connect() as conn:
+        for name, sql, params in ENDPOINT_QUERIES:
+            try:
+                rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params).all()
+                plans[name] = [row[-1] for row in rows]
+            except Exception as e:
+                plans[name] = [f"error: {str(e).splitlines()[0]}"]
+    return plans
+
+def print_query_plans(before: dict, after: dict):
+    for name, _, _ in ENDPOINT_QUERIES:
+        print(f"\n{name}")
+        if before is not None and before[name] != after[name]:
+            for line in before[name]:
+                print(f"  before: {line}")
+            for line in after[name]:
+                print(f"  after:  {line}")
+        else:
+            for line in after[name]:
+                print(f"  {line}")
 
 def run_migrations():
     print("Running database migrations...")
     try:
-        # This will create all tables that don't exist yet
-        Base.metadata.create_all(bind=engine)
+        with engine.connect() as conn:
+            current = get_schema_version(conn)
+        pending = [migration for migration in MIGRATIONS if migration[0] > current]
+        if not pending:
+            print(f"Database is up to date (version {current}).")
+            return
+
+        before = explain_queries()
+        for version, description, steps in pending:
+            print(f"Applying {version}: {description}")
+            with engine.begin() as conn:
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(text(step))
+                conn.execute(text(f"PRAGMA user_version = {version}"))
         print("Database migrations completed successfully!")
+
+        print("\nQuery plans:")
+        print_query_plans(before, explain_queries())
     except Exception as e:
         print(f"Error running migrations: {e}")
         raise
 
+def rebuild_search_index():
+    print("Rebuilding full-text search index...")
+    try:
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            for statement in SEARCH_INDEX_DDL:
+                conn.execute(text(statement))
+            # Re-reads every row of posts into posts_fts
+            conn.execute(text("INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')"))
+            count = conn.execute(text("SELECT COUNT(*) FROM posts")).scalar()
+        print(f"Indexed {count} posts.")
+    except Exception as e:
+        print(f"Error rebuilding search index: {e}")
+        raise
+
+COMMANDS = {
+    "migrate": run_migrations,
+    "rebuild-search": rebuild_search_index,
+    "explain": lambda: print_query_plans(None, explain_queries()),
+}
+
 if __name__ == "__main__":
-    run_migrations()
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    if command not in COMMANDS:
+        print(f"Usage: python migrate.py [{' | '.join(COMMANDS)}]")
+        sys.exit(2)
+    COMMANDS[command]()